@@ -1,6 +1,8 @@
 import os
+import atexit
+import queue
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
+from logging.handlers import SMTPHandler, RotatingFileHandler, QueueHandler, QueueListener
 from flask import Flask, request, current_app, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -27,6 +29,14 @@ def create_app(config_class=Config):
     moment.init_app(app)
     mail.init_app(app)
 
+    from app import perf, metrics, profiling, invalidation, cache, render
+    perf.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    invalidation.init_app(app)
+    cache.init_app(app)
+    render.init_app(app)
+
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
 
@@ -58,9 +68,10 @@ def create_app(config_class=Config):
             stream_handler.setLevel(logging.INFO)
             app.logger.addHandler(stream_handler)
         else:
-            if not os.path.exists('textlogs'):
-                os.mkdir('textlogs')
-            file_handler = RotatingFileHandler('textlogs/flask_writer.log',
+            log_dir = app.config['LOG_DIR']
+            if not os.path.exists(log_dir):
+                os.mkdir(log_dir)
+            file_handler = RotatingFileHandler(os.path.join(log_dir, 'flask_writer.log'),
                                        maxBytes=102400, backupCount=10)
             file_handler.setFormatter(logging.Formatter(
                     '%(asctime)s|%(levelname)s|%(pathname)s:%(lineno)d|'
@@ -68,7 +79,7 @@ def create_app(config_class=Config):
             file_handler.setLevel(logging.INFO)
             app.logger.addHandler(file_handler)
 
-            error_file_handler = RotatingFileHandler('textlogs/flask_writer_errors.log',
+            error_file_handler = RotatingFileHandler(os.path.join(log_dir, 'flask_writer_errors.log'),
                 maxBytes=10240, backupCount=5)
             error_file_handler.setFormatter(logging.Formatter(
                 '%(asctime)s|%(levelname)s'
@@ -76,6 +87,18 @@ def create_app(config_class=Config):
             error_file_handler.setLevel(logging.WARNING)
             app.logger.addHandler(error_file_handler)
 
+            audit_logger = logging.getLogger('app.audit')
+            if not audit_logger.handlers:
+                audit_file_handler = RotatingFileHandler(os.path.join(log_dir, 'flask_writer_audit.log'),
+                    maxBytes=1024000, backupCount=10)
+                audit_file_handler.setFormatter(logging.Formatter('%(message)s'))
+                audit_queue = queue.Queue(-1)
+                audit_listener = QueueListener(audit_queue, audit_file_handler)
+                audit_listener.start()
+                atexit.register(audit_listener.stop)
+                audit_logger.addHandler(QueueHandler(audit_queue))
+                audit_logger.propagate = False
+
         app.logger.setLevel(logging.INFO)
         app.logger.info('Flask Writer startup')
 
@@ -1,11 +1,19 @@
+import re
 from flask_wtf import FlaskForm
 from wtforms import (
         StringField, TextAreaField, SelectField, IntegerField, SubmitField, 
         BooleanField, SubmitField, DateTimeField, SelectMultipleField, 
-        PasswordField, HiddenField, DateField, TimeField
+        PasswordField, HiddenField, DateField, TimeField, FloatField
 )
 from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
-from wtforms.validators import DataRequired, Length, Email, Optional, EqualTo, ValidationError, InputRequired
+from wtforms.validators import (
+        DataRequired, Length, Email, Optional, EqualTo, ValidationError, InputRequired, 
+        NumberRange
+    )
+from flask import current_app, url_for
+from app import db
+from app.invalidation import bus
+from app.metrics import cache_hit, cache_miss
 from app.models import Page, User, Tag, Definition, Link, Product
 
 required = "<span class='text-danger'>*</span>"
@@ -32,6 +40,53 @@ class EditUserForm(FlaskForm):
 
 def all_tags():
     return Tag.query.order_by('name')
+
+CHOICES = {}
+
+def cached_choices(model):
+    """
+    Caches a list of (id, label) choices for the whole process. Any commit
+    that touches `model`, in any worker, moves its generation on the
+    invalidation bus and the next form rebuilds the list.
+    """
+    table = model.__table__.name
+    def decorator(func):
+        def wrapper():
+            generation = bus.generation(table)
+            cached = CHOICES.get(func.__name__)
+            if cached is None or cached[0] != generation:
+                cache_miss('choices')
+                cached = CHOICES[func.__name__] = (generation, func())
+            else:
+                cache_hit('choices')
+            return cached[1]
+        return wrapper
+    return decorator
+
+@cached_choices(Page)
+def page_choices():
+    return [(p.id, f"{p.title} ({p.path})") for p in 
+            db.session.query(Page.id, Page.title, Page.path).order_by(Page.path)]
+
+@cached_choices(User)
+def user_choices():
+    return [(u.id, u.username) for u in db.session.query(User.id, User.username).order_by(User.username)]
+
+@cached_choices(Product)
+def product_choices():
+    return [(p.id, p.name) for p in db.session.query(Product.id, Product.name).order_by(Product.name)]
+
+@cached_choices(Tag)
+def tag_choices():
+    return [(t.id, t.name) for t in db.session.query(Tag.id, Tag.name).order_by(Tag.name)]
+
+def set_page_choices(field, blank='---', selected=None):
+    choices = page_choices()
+    if len(choices) > current_app.config['PAGE_CHOICES_LIMIT']:
+        selected = selected if selected is not None else field.data
+        choices = [c for c in choices if c[0] == selected]
+        field.render_kw = dict(field.render_kw or {}, **{'data-ajax--url': url_for('admin.page_choices', blank=blank)})
+    field.choices = [(0, blank)] + choices
     
 class AddPageForm(FlaskForm):
    title = StringField(f'Title{required}', validators=[DataRequired()]) 
@@ -123,3 +178,20 @@ class RecordEditForm(FlaskForm):
     
 class DeleteObjForm(FlaskForm):
     obj_id = HiddenField('Object id', validators=[DataRequired()])
+
+class ResetForm(FlaskForm):
+    """A bare form, for buttons that POST and only need the CSRF token."""
+
+class ProfilingForm(FlaskForm):
+    enabled = BooleanField('Profiling On')
+    sample_rate = FloatField('Sample Rate', validators=[NumberRange(min=0, max=1)],
+            description="Fraction of requests to profile, e.g. 0.01")
+    path_pattern = StringField('Path Pattern', validators=[Length(max=200)],
+            description="Regex; when set, every matching request is profiled instead of sampling")
+    submit = SubmitField('Save Settings')
+
+    def validate_path_pattern(self, path_pattern):
+        try:
+            re.compile(path_pattern.data or '')
+        except re.error as e:
+            raise ValidationError(f'Invalid pattern: {e}')
@@ -1,64 +1,66 @@
 import re
+import json
+import hashlib
+import difflib
+import logging
+from datetime import datetime
+import threading
+from collections import OrderedDict
 from flask import current_app, flash
 from flask_login import current_user
+from sqlalchemy import inspect
+from app.models import Page, PageVersion
+from app.metrics import cache_hit, cache_miss
 
-def convert_to_dict(obj):
-    if type(obj) is not dict:
-        data = {'repr': repr(obj)}
-        for field in obj.__table__.columns:
-            data[field.key] = obj.__dict__.get(field.key)
-        #for field in obj.__table__.foreign_keys:
-        #    data[field.key] = repr(obj.__dict__.get(field.key))
-        try:
-            data["users"] = obj.users
-        except:
-            pass
-        try:
-            data["user"] = obj.user
-        except:
-            pass
-        try:
-            data["tags"] = obj.tags
-        except:
-            pass
-        try:
-            data["page"] = obj.page
-        except:
-            pass
-        try:
-            data["parent"] = obj.parent
-        except:
-            pass
-        return data
-    return obj
+DIFF_TOKENS = re.compile(r'\s+|\S+')
+AUDIT_TEXT_LIMIT = 200
+audit_logger = logging.getLogger('app.audit')
+
+def snapshot(obj):
+    """
+    Compact dict of an object's columns and loaded many-to-many collections.
+    Long text (page bodies and notes) is replaced by a hash so comparing two
+    snapshots never copies or compares the full text.
+    """
+    if type(obj) is dict:
+        return obj
+    state = inspect(obj)
+    data = {'repr': repr(obj)}
+    for attr in state.mapper.column_attrs:
+        value = state.dict.get(attr.key)
+        if isinstance(value, str) and len(value) > AUDIT_TEXT_LIMIT:
+            value = f"sha1:{hashlib.sha1(value.encode('utf-8')).hexdigest()[0:12]} ({len(value)} chars)"
+        data[attr.key] = value
+    for rel in state.mapper.relationships:
+        if rel.secondary is not None and rel.key in state.dict:
+            data[rel.key] = sorted(str(o) for o in state.dict[rel.key])
+    return data
+
+def audit(message, obj, changes):
+    audit_logger.info(json.dumps({
+            'time': datetime.utcnow().isoformat(),
+            'user': current_user.username if current_user.is_authenticated else None,
+            'action': message,
+            'model': obj.__class__.__name__,
+            'id': getattr(obj, 'id', None),
+            'changes': changes,
+        }, default=str))
 
 def log_new(obj, message=''):
-    data = convert_to_dict(obj)
-    output = f'{current_user.username} {message}:\n'
-    for key, value in data.items():
-        char_cap = 1000
-        value = value if type(value) is not str or len(value) < char_cap else f"{value[0:100]}...{value[-100:]}"
-        output += f"    {key}: {value}\n"
-    #print(output)
-    current_app.logger.info(output)
+    data = snapshot(obj)
+    data.pop('repr')
+    audit(message, obj, data)
     return True
 
 def log_change(original, updated=None, message='changed something'):
-    original_data = convert_to_dict(original)
+    original_data = snapshot(original)
     if updated:
-        output = f'{current_user.username} {message}:\n'
-        output += f"Changed object: {original['repr']}\n"
-        updated_data = convert_to_dict(updated)
+        updated_data = snapshot(updated)
+        changes = {}
         for key, value in original_data.items():
-            if key != 'repr':
-                if key not in updated_data or value != updated_data[key]:
-                    char_cap = 1000
-                    value = value if type(value) is not str or len(value) < char_cap else f"{value[0:100]}...{value[-100:]}"
-                    new_value = updated_data[key] 
-                    new_value = new_value if type(new_value) is not str or len(new_value) < char_cap else f"{new_value[0:100]}...{new_value[-100:]}"
-                    output += f'    {key}: {value}  ===CHANGED TO===>  {new_value}\n'
-        #print(output)
-        current_app.logger.info(output)
+            if key != 'repr' and value != updated_data.get(key):
+                changes[key] = [value, updated_data.get(key)]
+        audit(message, updated, changes)
         return True
     return original_data
     
@@ -77,3 +79,77 @@ def flash_form_errors(form_obj):
             msg += f"<li>{error}</li>"
     
         flash(msg, 'danger')
+
+def diff_words(original, updated):
+    """
+    Yields (op, text) pairs where op is 'equal', 'delete' or 'insert'.
+    Lines are matched first so only changed paragraphs are diffed word by word.
+    """
+    original_lines = original.splitlines(keepends=True)
+    updated_lines = updated.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, original_lines, updated_lines, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            yield ('equal', ''.join(original_lines[i1:i2]))
+        elif op == 'delete':
+            yield ('delete', ''.join(original_lines[i1:i2]))
+        elif op == 'insert':
+            yield ('insert', ''.join(updated_lines[j1:j2]))
+        else:
+            original_words = DIFF_TOKENS.findall(''.join(original_lines[i1:i2]))
+            updated_words = DIFF_TOKENS.findall(''.join(updated_lines[j1:j2]))
+            words = difflib.SequenceMatcher(None, original_words, updated_words, autojunk=False)
+            for wop, w1, w2, v1, v2 in words.get_opcodes():
+                if wop in ('equal', 'delete', 'replace') and w2 > w1:
+                    yield ('equal' if wop == 'equal' else 'delete', ''.join(original_words[w1:w2]))
+                if wop in ('insert', 'replace') and v2 > v1:
+                    yield ('insert', ''.join(updated_words[v1:v2]))
+
+def version_body(page_id, ver_id):
+    if ver_id == 'current':
+        return Page.query.with_entities(Page.body).filter_by(id=page_id).scalar() or ''
+    return PageVersion.query.with_entities(PageVersion.body).filter_by(
+            id=ver_id, original_id=page_id).scalar() or ''
+
+class DiffCache(object):
+    """
+    LRU of word diffs, bounded by the characters of the bodies behind them.
+    Diffs of bodies over `entry_chars` aren't kept; they stream straight from
+    diff_words(). Records its own hits so concurrent requests can't skew them.
+    """
+
+    def __init__(self, max_chars=4000000, entry_chars=200000):
+        self.max_chars = max_chars
+        self.entry_chars = entry_chars
+        self.chars = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, original, updated):
+        chars = len(original) + len(updated)
+        if chars > self.entry_chars:
+            cache_miss('version_diff')
+            return diff_words(original, updated)
+        key = hashlib.sha1(original.encode('utf-8') + b'\0' + updated.encode('utf-8')).digest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None:
+            cache_hit('version_diff')
+            return entry[0]
+        cache_miss('version_diff')
+        diff = tuple(diff_words(original, updated))
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (diff, chars)
+                self.chars += chars
+            while self.chars > self.max_chars:
+                self.chars -= self.entries.popitem(last=False)[1][1]
+        return diff
+
+diff_cache = DiffCache()
+
+def version_diff(page_id, original, updated):
+    """The word diff of two versions ('current' for the page itself), keyed by their text."""
+    return diff_cache.get(version_body(page_id, original), version_body(page_id, updated))
@@ -1,22 +1,142 @@
-from flask import render_template, redirect, current_app, url_for, flash, request
+import re
+from datetime import datetime, date
+from flask import render_template, redirect, current_app, url_for, flash, request, jsonify
 from flask.views import View, MethodView
 from flask_login import login_required
+from sqlalchemy import or_, and_
 from app.admin.functions import log_new, log_change, log_form, flash_form_errors
 from app.admin.forms import DeleteObjForm
 from app import db
 from app.models import Page
 
+LIKE_SPECIAL = re.compile(r'[\\%_]')
+
 class ListView(MethodView):
+    """
+    Renders `template` on a normal GET. When DataTables asks for rows (the
+    request carries `draw`) it answers with server-side processing JSON instead:
+        'model': the model being listed
+        'columns': list of (macro name, sortable column or None), in table order
+        'search_columns': columns matched with ILIKE against the search box
+        'row_template': template holding one macro per column, each taking a row,
+                        plus an optional `row_class` macro for the <tr> class
+    As with SaveObjView, class attributes are shared configuration and the
+    context is copied per request in __init__.
+    Moving forward one page sends the last row's sort value and id back as
+    `after`/`after_id` (or `after_null` once into the NULLs, which sort last),
+    so deep pages use keyset pagination instead of OFFSET. Columns from other
+    tables are treated as nullable, since query() may reach them by outer join.
+    """
 
+    decorators = [login_required]
     template = 'main/index.html'
+    row_template = None
+    model = None
+    columns = []
+    search_columns = []
     context = {}
 
+    def __init__(self):
+        self.context = dict(self.context)
+
     def extra(self):
         pass
 
+    def query(self):
+        return self.model.query
+
+    def row_context(self):
+        return {}
+
     def get(self):
         self.extra()
-        return self.render_template(self.template, **self.context)
+        if 'draw' in request.args:
+            return jsonify(self.server_side())
+        self.context.update({'page': Page.query.filter_by(slug='admin').first()})
+        return render_template(self.template, **self.context)
+
+    def nullable(self, column):
+        """Whether `column` can sort as NULL; one reached through an outer join can, whatever it declares."""
+        if getattr(column, 'table', None) is not self.model.__table__:
+            return True
+        return column.nullable
+
+    def cursor_value(self, column, value):
+        python_type = column.type.python_type
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+        return python_type(value)
+
+    def server_side(self):
+        args = request.args
+        start = args.get('start', 0, type=int)
+        length = args.get('length', 10, type=int)
+        search = args.get('search[value]', '').strip()
+        sort_index = args.get('order[0][column]', 0, type=int)
+        descending = args.get('order[0][dir]') == 'desc'
+        sort_column = self.columns[sort_index][1] if sort_index < len(self.columns) else None
+        sort_column = sort_column if sort_column is not None else self.model.id
+
+        query = self.query()
+        total = query.order_by(None).count()
+        if search and self.search_columns:
+            pattern = '%' + LIKE_SPECIAL.sub(r'\\\g<0>', search) + '%'
+            query = query.filter(or_(*[c.ilike(pattern, escape='\\') for c in self.search_columns]))
+            filtered = query.order_by(None).count()
+        else:
+            filtered = total
+
+        ## NULLs can't be compared with < or >, so nullable columns sort them last explicitly
+        ## and page through them by id alone
+        nullable = self.nullable(sort_column)
+        after, after_id = args.get('after'), args.get('after_id', type=int)
+        after_null = args.get('after_null') == '1'
+        offset = 0
+        if start and after_id and (after or after_null):
+            newer = self.model.id < after_id if descending else self.model.id > after_id
+            if after_null:
+                query = query.filter(sort_column.is_(None), newer)
+            else:
+                after = self.cursor_value(sort_column, after)
+                beyond = sort_column < after if descending else sort_column > after
+                following = [beyond, and_(sort_column == after, newer)]
+                if nullable:
+                    following.append(sort_column.is_(None))
+                query = query.filter(or_(*following))
+        elif start:
+            ## a jump to a page with no cursor for it
+            offset = start
+        order = [sort_column.is_(None)] if nullable else []
+        if descending:
+            query = query.order_by(*order, sort_column.desc(), self.model.id.desc())
+        else:
+            query = query.order_by(*order, sort_column.asc(), self.model.id.asc())
+        if offset:
+            query = query.offset(offset)
+        if length > 0:
+            query = query.limit(length)
+        rows = query.add_columns(sort_column.label('sort_key')).all()
+
+        macros = current_app.jinja_env.get_template(self.row_template).make_module(self.row_context())
+        data = []
+        for row in rows:
+            cells = {str(i): str(getattr(macros, column)(row[0])) for i, (column, sort) in enumerate(self.columns)}
+            if hasattr(macros, 'row_class'):
+                cells['DT_RowClass'] = str(macros.row_class(row[0])).strip()
+            data.append(cells)
+        cursor = None
+        if rows:
+            last = rows[-1]
+            cursor = [str(last.sort_key), last[0].id, 0] if last.sort_key is not None else ['', last[0].id, 1]
+        return {
+                'draw': args.get('draw', 0, type=int),
+                'recordsTotal': total,
+                'recordsFiltered': filtered,
+                'data': data,
+                'cursor': cursor,
+            }
 
 class SaveObjView(MethodView):
     """
@@ -34,6 +154,9 @@ class SaveObjView(MethodView):
         'redirect': url for redirect on success
         'context': a dictionary of items to pass to the template
     }
+    Class attributes are configuration shared by every request and are never
+    mutated. as_view() builds a new instance per request, so the context, obj
+    and bound forms set on self belong to that request only.
     """
     
     decorators = [login_required]
@@ -52,13 +175,10 @@ class SaveObjView(MethodView):
     delete_endpoint = None
     context = {}
 
-    def __init__(self): #, **kwargs):
-        #self.__dict__.update(kwargs)
-        self.context.update(**self.__dict__)
+    def __init__(self):
+        self.context = dict(self.context)
         if self.action:
             self.context.update({'action': self.action})
-        if self.action == 'Edit':
-            self.context.update({'obj': self.obj})
         if self.title:
             self.context.update({'title': self.title})
         if self.model_name:
@@ -72,7 +192,6 @@ class SaveObjView(MethodView):
 
 
     def set_object(self, obj_id):
-        current_app.logger.debug(f'Form: {self.form()}')
         if obj_id and self.model:
             self.obj = self.model.query.filter_by(id=obj_id).first()
         if self.form:
@@ -86,6 +205,7 @@ class SaveObjView(MethodView):
             self.context.update({'form': self.form})
         if self.model and not self.obj:
             self.obj = self.model()
+        self.context.update({'obj': self.obj})
         self.delete_form = self.delete_form() if self.delete_form else DeleteObjForm()
         if self.obj and self.obj.id:
             self.delete_form.obj_id.data = self.obj.id
@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+from flask import current_app
+
+LOG_FILES = {
+        'info': 'flask_writer.log',
+        'error': 'flask_writer_errors.log',
+        'audit': 'flask_writer_audit.log',
+        'slow': 'flask_writer_slow_queries.log',
+    }
+LOG_LINE = re.compile(r'^(\d{4}-\d\d-\d\d [\d:,]+)\|([A-Z]+)\|([^|]*)\|(.*)$')
+CHUNK_SIZE = 8192
+
+
+def log_path(name, rotation=0):
+    path = os.path.join(current_app.config['LOG_DIR'], LOG_FILES[name])
+    return f'{path}.{rotation}' if rotation else path
+
+def rotated_paths(name):
+    rotation = 0
+    while os.path.exists(log_path(name, rotation)):
+        yield log_path(name, rotation)
+        rotation += 1
+
+def parse_line(line):
+    if line.startswith('{'):
+        return parse_json_line(line)
+    match = LOG_LINE.match(line)
+    if not match:
+        return None
+    asctime, level, location, message = match.groups()
+    return {'time': asctime, 'level': level, 'location': location, 'message': message}
+
+def parse_json_line(line):
+    ## audit records are written one JSON object per line
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    location = f"{data.get('model', '')} {data.get('id') or ''}".strip()
+    if data.get('user'):
+        location = f"{data['user']}: {location}"
+    message = data.get('action') or ''
+    if data.get('changes'):
+        message += ' ' + json.dumps(data['changes'])
+    return {'time': data.get('time', ''), 'level': data.get('level', 'INFO'), 
+            'location': location, 'message': message.strip()}
+
+def lines_backwards(path, before=None):
+    """
+    Yields (offset, line) from the end of the file (or from byte `before`)
+    towards the start, reading fixed-size chunks so memory stays constant.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END) if before is None else min(before, f.seek(0, os.SEEK_END))
+        remainder = b''
+        while position > 0:
+            size = min(CHUNK_SIZE, position)
+            position -= size
+            f.seek(position)
+            chunk = f.read(size) + remainder
+            lines = chunk.split(b'\n')
+            remainder = lines.pop(0)
+            offset = position + len(remainder) + 1
+            starts = []
+            for line in lines:
+                starts.append(offset)
+                offset += len(line) + 1
+            for start, line in zip(reversed(starts), reversed(lines)):
+                if line:
+                    yield start, line.decode('utf-8', 'replace')
+        if remainder:
+            yield 0, remainder.decode('utf-8', 'replace')
+
+def records_backwards(path, before=None):
+    """
+    Groups continuation lines (multi-line messages) with the line that starts
+    the record. Yields (offset, record), newest first.
+    """
+    continued = []
+    for offset, line in lines_backwards(path, before):
+        record = parse_line(line)
+        if record is None:
+            continued.append(line)
+            continue
+        if continued:
+            record['message'] += '\n' + '\n'.join(reversed(continued))
+            continued = []
+        yield offset, record
+
+def tail(name, before=None, limit=100):
+    path = log_path(name)
+    records = []
+    next_before = 0
+    if os.path.exists(path):
+        for offset, record in records_backwards(path, before):
+            records.append(record)
+            next_before = offset
+            if len(records) >= limit:
+                break
+    return {'records': records, 'before': next_before if len(records) >= limit else None}
+
+def search(name, keyword='', level=None):
+    """Streams matching records as JSON lines, newest file first."""
+    keyword = keyword.lower()
+    for path in rotated_paths(name):
+        record = None
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parsed = parse_line(line.rstrip('\n'))
+                if parsed is None:
+                    if record is not None:
+                        record['message'] += '\n' + line.rstrip('\n')
+                    continue
+                if record is not None and matches(record, keyword, level):
+                    yield json.dumps(dict(record, file=os.path.basename(path))) + '\n'
+                record = parsed
+        if record is not None and matches(record, keyword, level):
+            yield json.dumps(dict(record, file=os.path.basename(path))) + '\n'
+
+def matches(record, keyword, level):
+    if level and record['level'] != level:
+        return False
+    return not keyword or keyword in record['message'].lower() or keyword in record['location'].lower()
+
+def slow_queries(limit=1000):
+    """
+    The newest `limit` slow query records grouped by normalized SQL, slowest
+    first. A SQLite plan step that SCANs a table without an index is flagged.
+    """
+    groups = {}
+    path = log_path('slow')
+    if not os.path.exists(path):
+        return []
+    for i, (offset, line) in enumerate(lines_backwards(path)):
+        if i >= limit:
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        group = groups.setdefault(record['sql'], {
+                'sql': record['sql'], 'count': 0, 'total_ms': 0, 'max_ms': 0, 
+                'endpoints': set(), 'sites': set(), 'last': record['time'], 
+                'params': record['params'], 'plan': record['plan'] or [],
+            })
+        group['count'] += 1
+        group['total_ms'] += record['ms']
+        group['max_ms'] = max(group['max_ms'], record['ms'])
+        group['endpoints'].add(record['endpoint'] or 'cli')
+        group['sites'].add(record['site'])
+    for group in groups.values():
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 2)
+        group['full_scan'] = any(step.split(' | ')[-1].startswith('SCAN ') and 'INDEX' not in step 
+                for step in group['plan'])
+    return sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
+
+def follow(path, interval=1, heartbeat=15):
+    """
+    Server-Sent Events for lines appended to `path` after the stream opens.
+    Needs no app or request context, so the stream holds no DB connection.
+    """
+    f = open(path, encoding='utf-8', errors='replace')
+    f.seek(0, os.SEEK_END)
+    inode = os.fstat(f.fileno()).st_ino
+    idle = 0
+    partial = ''
+    try:
+        ## most servers hold the headers back until the first chunk, so open with one
+        yield ': open\n\n'
+        while True:
+            line = f.readline()
+            if line:
+                idle = 0
+                partial += line
+                if not partial.endswith('\n'):
+                    continue
+                line, partial = partial, ''
+                record = parse_line(line.rstrip('\n')) or {'message': line.rstrip('\n')}
+                yield f'data: {json.dumps(record)}\n\n'
+                continue
+            time.sleep(interval)
+            idle += interval
+            if idle >= heartbeat:
+                idle = 0
+                yield ': keep-alive\n\n'
+            if os.path.exists(path) and os.stat(path).st_ino != inode:
+                f.close()
+                f = open(path, encoding='utf-8', errors='replace')
+                inode = os.fstat(f.fileno()).st_ino
+    finally:
+        f.close()
@@ -1,22 +1,29 @@
+import os
 import pytz
-import re
-from flask import render_template, redirect, flash, url_for, send_from_directory, current_app, request
+from flask import (
+        render_template, redirect, flash, url_for, send_from_directory, current_app, 
+        request, Response, stream_with_context, jsonify
+    )
 from app import db
-from app.admin import bp
-from app.admin.functions import log_new, log_change
+from app.admin import bp, logs as log_files
+from app import perf, profiling
+from app.admin.functions import log_new, log_change, version_diff, flash_form_errors
+from app.render import stream_template
+from app.content import Content
 from app.admin.forms import (
         AddUserForm, AddPageForm, AddTagForm, EditUserForm, DefinitionEditForm, 
-        EmailForm, LinkEditForm, ProductEditForm, RecordForm, RecordEditForm
+        EmailForm, LinkEditForm, ProductEditForm, RecordForm, RecordEditForm, ProfilingForm,
+        ResetForm, set_page_choices, user_choices, product_choices, tag_choices
     )
-from app.admin.generic_views import SaveObjView, DeleteObjView
+from app.admin.generic_views import ListView, SaveObjView, DeleteObjView, LIKE_SPECIAL
 from app.models import (
         Page, User, Tag, PageVersion, Subscriber, Definition, Link, Product, 
-        Record
+        Record, tags as page_tags
     )
 from flask_login import login_required, current_user
-from sqlalchemy import desc
+from sqlalchemy import desc, or_
+from sqlalchemy.orm import defer, noload
 from datetime import datetime, time, timedelta
-from markdown import markdown
 from app.email import send_email
 from dateutil.relativedelta import relativedelta
 
@@ -73,25 +80,37 @@ def edit_user(id):
     form.timezone.data = user.timezone
     return render_template('admin/user-edit.html', form=form, tab='users', action='Edit', user=user,page=page)
 
-@bp.route('/admin/pages')
-@login_required
-def pages(unpub=None):
-    page = Page.query.filter_by(slug='admin').first()
-    Page.set_nav()
-    if unpub:
-        pages = Page.query.filter_by(published=False).order_by('dir_path','sort','title')
-    else: 
-        pages = Page.query.filter_by(published=True).order_by('dir_path','sort','title')
-    return render_template('admin/pages.html', 
-            tab='pages', 
-            pages=pages, 
-            unpub=unpub,
-            page=page,
-        )
-
-@bp.route('/admin/pages/unpublished')
-def unpublished_pages():
-    return pages(unpub=True)
+class PageList(ListView):
+    template = 'admin/pages.html'
+    row_template = 'admin/rows/pages.html'
+    model = Page
+    published = True
+    columns = [
+            ('title', Page.title),
+            ('path', Page.path),
+            ('template', Page.template),
+            ('word_count', None),
+            ('pub_date', Page.pub_date),
+        ]
+    search_columns = [Page.title, Page.path, Page.template]
+    context = {'tab': 'pages', 'unpub': False}
+
+    def query(self):
+        return Page.query.filter_by(published=self.published).options(
+                defer('notes'), defer('sidebar'), noload('tags'))
+
+    def row_context(self):
+        return {'unpub': not self.published}
+
+bp.add_url_rule("/admin/pages", view_func=PageList.as_view('pages'))
+
+class UnpublishedPageList(PageList):
+    published = False
+    columns = PageList.columns[:-1]
+    context = {'tab': 'pages', 'unpub': True}
+
+bp.add_url_rule("/admin/pages/unpublished", 
+        view_func=UnpublishedPageList.as_view('unpublished_pages'))
 
 @bp.route('/admin/page/add', methods=['GET', 'POST'])
 @login_required
@@ -99,8 +118,8 @@ def add_page():
     form = AddPageForm()
     for field in form:
         print(f"{field.name}: {field.data}")
-    form.parent_id.choices = [(0,'---')] + [(p.id, f"{p.title} ({p.path})") for p in Page.query.all()]
-    form.user_id.choices = [(u.id, u.username) for u in User.query.all()]
+    set_page_choices(form.parent_id)
+    form.user_id.choices = user_choices()
     form.notify_group.choices = [('all', 'All')] + Subscriber.SUBSCRIPTION_CHOICES
     if form.validate_on_submit():
         parentid = form.parent_id.data if form.parent_id.data else None
@@ -130,7 +149,6 @@ def add_page():
         db.session.commit()
         flash("Page added successfully.", "success")
         log_new(page, 'added a page')
-        Page.set_nav()
         return redirect(url_for('admin.pages'))
     if form.errors:
         flash("<b>Error!</b> Please fix the errors below.", "danger")
@@ -151,8 +169,8 @@ def edit_page(id, ver_id=None):
     for anc in page.ancestors():
         print(f"ANCESTOR: {anc}")
     form = AddPageForm()
-    form.parent_id.choices = [(0,'---')] + [(p.id, f"{p.title} ({p.path})") for p in Page.query.all()]
-    form.user_id.choices = [(u.id, u.username) for u in User.query.all()]
+    set_page_choices(form.parent_id)
+    form.user_id.choices = user_choices()
     form.notify_group.choices = [('all', 'All')] + Subscriber.SUBSCRIPTION_CHOICES
     for field in form:
         print(f"{field.name}: {field.data}")
@@ -209,11 +227,11 @@ def edit_page(id, ver_id=None):
         log_change(log_orig, page, 'edited a page')
         db.session.commit()
         flash("Page updated successfully.", "success")
-        Page.set_nav()
         return redirect(url_for('admin.edit_page', id=id))
     if form.errors:
         flash("<b>Error!</b> Please fix the errors below.", "danger")
-    versions = PageVersion.query.filter_by(original_id=id).order_by(desc('edit_date')).all()
+    versions = db.session.query(PageVersion.id, PageVersion.title, PageVersion.edit_date
+            ).filter_by(original_id=id).order_by(desc('edit_date')).all()
     version = PageVersion.query.filter_by(id=ver_id).first() if ver_id else None
     if version:
         form.title.data = version.title
@@ -245,6 +263,7 @@ def edit_page(id, ver_id=None):
         form.pub_date.data = page.local_pub_date(current_user.timezone)
         form.pub_time.data = page.local_pub_date(current_user.timezone)
         form.published.data = page.published
+    set_page_choices(form.parent_id)
     return render_template('admin/page-edit.html', 
             form=form, 
             tab='pages', 
@@ -255,6 +274,51 @@ def edit_page(id, ver_id=None):
             page = Page.query.filter_by(slug='admin').first()
         )
 
+@bp.route('/admin/page/choices')
+@login_required
+def page_choices():
+    term = request.args.get('q', '')
+    page_num = request.args.get('page', 1, type=int)
+    per_page = 30
+    query = db.session.query(Page.id, Page.title, Page.path)
+    if term:
+        pattern = '%' + LIKE_SPECIAL.sub(r'\\\g<0>', term) + '%'
+        query = query.filter(or_(Page.title.ilike(pattern, escape='\\'),
+                Page.path.ilike(pattern, escape='\\')))
+    results = query.order_by(Page.path).offset((page_num - 1) * per_page).limit(per_page + 1).all()
+    ## the form's blank leads the first page, so a parent can be cleared again
+    blank = [{'id': 0, 'text': request.args.get('blank', '---')}] if not term and page_num == 1 else []
+    return jsonify({
+            'results': blank + [{'id': p.id, 'text': f"{p.title} ({p.path})"} for p in results[:per_page]],
+            'pagination': {'more': len(results) > per_page},
+        })
+
+@bp.route('/admin/page/<int:id>/diff/<string:original>/<string:updated>')
+@login_required
+def page_diff(id, original, updated):
+    edit_page = db.session.query(Page.id, Page.title, Page.path, Page.edit_date).filter_by(id=id).first()
+    labels = []
+    for ver_id in (original, updated):
+        if ver_id == 'current' and edit_page:
+            labels.append(f'Current - {edit_page.edit_date.strftime("%b. %-d, %Y - %-I:%M %p")}')
+        elif ver_id.isdigit():
+            version = db.session.query(PageVersion.edit_date).filter_by(
+                    id=int(ver_id), original_id=id).first()
+            if version:
+                labels.append(version.edit_date.strftime("%b. %-d, %Y - %-I:%M %p"))
+    if len(labels) < 2:
+        flash("<b>Error!</b> That version could not be found.", "danger")
+        return redirect(url_for('admin.pages'))
+    original = original if original == 'current' else int(original)
+    updated = updated if updated == 'current' else int(updated)
+    diff = version_diff(id, original, updated)
+    return Response(stream_with_context(stream_template('admin/page-diff.html',
+            tab='pages',
+            edit_page=edit_page,
+            diff=diff,
+            labels=labels,
+            page=Page.query.filter_by(slug='admin').first()
+        )))
 
 @bp.route('/admin/tags')
 @login_required
@@ -301,17 +365,24 @@ def edit_tag(id):
     form.name.data = tag.name
     return render_template('admin/tag-edit.html', form=form, tab='tags', tag=tag, action='Edit', page=page)
 
-@bp.route('/admin/definitions')
-@login_required
-def definitions():
-    page = Page.query.filter_by(slug='admin').first()
-    definitions = Definition.query.order_by('name')
-    return render_template('admin/definitions.html', 
-            tab='definitions', 
-            definitions=definitions, 
-            page=page,
-            len=len,
-        )
+class DefinitionList(ListView):
+    template = 'admin/definitions.html'
+    row_template = 'admin/rows/definitions.html'
+    model = Definition
+    columns = [
+            ('name', Definition.name),
+            ('parent', Page.title),
+            ('type', Definition.type),
+            ('mentions', db.select([db.func.count()]).where(
+                    page_tags.c.tag_id == Definition.tag_id).as_scalar()),
+        ]
+    search_columns = [Definition.name, Definition.type, Page.title]
+    context = {'tab': 'definitions'}
+
+    def query(self):
+        return Definition.query.outerjoin(Page, Definition.parent_id == Page.id)
+
+bp.add_url_rule("/admin/definitions", view_func=DefinitionList.as_view('definitions'))
 
 class AddDefinition(SaveObjView):
     title = "Add Definition"
@@ -326,8 +397,8 @@ class AddDefinition(SaveObjView):
 
     def extra(self):
         self.form.type.choices = Definition.TYPE_CHOICES
-        self.form.tag_id.choices = [(0,'')] + [(t.id, t.name) for t in Tag.query.order_by('name').all()]
-        self.form.parent_id.choices = [(0,'')] + [(p.id, str(p)) for p in Page.query.all()]
+        self.form.tag_id.choices = [(0,'')] + tag_choices()
+        set_page_choices(self.form.parent_id, blank='')
         self.context['tab'] = 'definitions'
         #self.context.update({'form': self.form})
 
@@ -353,8 +424,8 @@ class EditDefinition(SaveObjView):
 
     def extra(self):
         self.form.type.choices = Definition.TYPE_CHOICES
-        self.form.tag_id.choices = [(0,'')] + [(t.id, t.name) for t in Tag.query.all()]
-        self.form.parent_id.choices = [(0,'')] + [(p.id, str(p)) for p in Page.query.all()]
+        self.form.tag_id.choices = [(0,'')] + tag_choices()
+        set_page_choices(self.form.parent_id, blank='')
         self.context['tab'] = 'definitions'
         #self.context.update({'form': self.form})
 
@@ -376,16 +447,18 @@ class DeleteDefinition(DeleteObjView):
 bp.add_url_rule("/admin/Definition/delete", 
         view_func = login_required(DeleteDefinition.as_view('delete_definition')))
 
-@bp.route('/admin/links')
-@login_required
-def links():
-    page = Page.query.filter_by(slug='admin').first()
-    links = Link.query.all()
-    return render_template('admin/links.html',
-            tab='shop',
-            page=page,
-            links=links,
-        )
+class LinkList(ListView):
+    template = 'admin/links.html'
+    row_template = 'admin/rows/links.html'
+    model = Link
+    columns = [
+            ('text', Link.text),
+            ('url', Link.url),
+        ]
+    search_columns = [Link.text, Link.url]
+    context = {'tab': 'shop'}
+
+bp.add_url_rule("/admin/links", view_func=LinkList.as_view('links'))
 
 class AddLink(SaveObjView):
     title = "Add Link"
@@ -400,7 +473,7 @@ class AddLink(SaveObjView):
 
     def extra(self):
         self.context['tab'] = 'shop'
-        self.form.product_id.choices = [(p.id, str(p)) for p in Product.query.all()]
+        self.form.product_id.choices = product_choices()
         current_app.logger.debug(request.args.get('product_id'))
         if request.args.get('product_id'):
             self.form.product_id.data = int(request.args.get('product_id'))
@@ -421,7 +494,7 @@ class EditLink(SaveObjView):
 
     def extra(self):
         self.context['tab'] = 'shop'
-        self.form.product_id.choices = [(p.id, str(p)) for p in Product.query.all()]
+        self.form.product_id.choices = product_choices()
 
 bp.add_url_rule("/admin/link/edit/<int:obj_id>", 
         view_func=login_required(EditLink.as_view('edit_link')))
@@ -435,16 +508,21 @@ class DeleteLink(DeleteObjView):
 bp.add_url_rule("/admin/link/delete", 
         view_func = login_required(DeleteLink.as_view('delete_link')))
 
-@bp.route('/admin/products')
-@login_required
-def products():
-    page = Page.query.filter_by(slug='admin').first()
-    products = Product.query.all()
-    return render_template('admin/products.html',
-            tab='shop',
-            page=page,
-            products=products,
-        )
+class ProductList(ListView):
+    template = 'admin/products.html'
+    row_template = 'admin/rows/products.html'
+    model = Product
+    columns = [
+            ('name', Product.name),
+            ('price', Product.price),
+            ('description', Product.description),
+            ('image', None),
+            ('links', None),
+        ]
+    search_columns = [Product.name, Product.description]
+    context = {'tab': 'shop'}
+
+bp.add_url_rule("/admin/products", view_func=ProductList.as_view('products'))
 
 class AddProduct(SaveObjView):
     title = "Add Product"
@@ -604,12 +682,22 @@ class DeleteRecord(DeleteObjView):
 bp.add_url_rule("/admin/record/delete", 
         view_func = login_required(DeleteRecord.as_view('delete_record')))
 
-@bp.route('/admin/subscribers')
-@login_required
-def subscribers():
-    page = Page.query.filter_by(slug='admin').first()
-    subscribers = Subscriber.query.order_by('email').all()
-    return render_template('admin/subscribers.html', tab='subscribers', subscribers=subscribers, page=page)
+class SubscriberList(ListView):
+    template = 'admin/subscribers.html'
+    row_template = 'admin/rows/subscribers.html'
+    model = Subscriber
+    columns = [
+            ('name', Subscriber.first_name),
+            ('email', Subscriber.email),
+            ('subscription', Subscriber.subscription),
+            ('sub_date', Subscriber.sub_date),
+            ('actions', None),
+        ]
+    search_columns = [Subscriber.first_name, Subscriber.last_name, Subscriber.email, 
+            Subscriber.subscription]
+    context = {'tab': 'subscribers'}
+
+bp.add_url_rule("/admin/subscribers", view_func=SubscriberList.as_view('subscribers'))
 
 @bp.route('/admin/subscriber/email', methods=['GET','POST'])
 @login_required
@@ -618,9 +706,9 @@ def send_mail():
     form = EmailForm()
     form.recipients.choices = [(s.id, f'{s.name_if_given(True)} ({s.email})') for s in Subscriber.query.all()] 
     if form.validate_on_submit():
-        html = markdown(form.body.data.replace('--', '&#8212;').replace('---', '<center>&#127793;</center>'))
-        pattern = re.compile(r'<.*?>')
-        body = pattern.sub('', html)
+        content = Content(form.body.data)
+        html = content.html
+        body = content.text
         banner = form.banner.data if form.banner.data else ''
         sent_to = []
         for recipient_id in form.recipients.data:
@@ -642,12 +730,110 @@ def send_mail():
 def logs():
     return send_from_directory(current_app.config['TEMPLATE_DIR'] + 'admin','logs.html')
 
+@bp.route("/admin/perf")
+@login_required
+def perf_dashboard():
+    return render_template('admin/perf.html', tab='perf', stats=sorted(perf.stats.summary().items()), 
+            form=ResetForm(), page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/perf.json")
+@login_required
+def perf_json():
+    return jsonify(perf.stats.summary())
+
+@bp.route("/admin/perf/reset", methods=['POST'])
+@login_required
+def perf_reset():
+    form = ResetForm()
+    if form.validate_on_submit():
+        perf.stats.reset()
+        flash("Performance stats cleared.", "success")
+    else:
+        flash_form_errors(form)
+    return redirect(url_for('admin.perf_dashboard'))
+
+@bp.route("/admin/slow-queries")
+@login_required
+def slow_queries():
+    return render_template('admin/slow-queries.html', tab='perf', queries=log_files.slow_queries(),
+            threshold=current_app.config['SLOW_QUERY_MS'], page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/profiles", methods=['GET', 'POST'])
+@login_required
+def profiles():
+    form = ProfilingForm(data=profiling.load_settings())
+    if form.validate_on_submit():
+        profiling.save_settings(form.enabled.data, form.sample_rate.data, form.path_pattern.data.strip())
+        flash("Profiling settings saved.", "success")
+        return redirect(url_for('admin.profiles'))
+    flash_form_errors(form)
+    return render_template('admin/profiles.html', tab='perf', form=form, profiles=profiling.profiles(),
+            page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/profiles/<name>")
+@login_required
+def profile(name):
+    stats = profiling.load_stats(name)
+    if stats is None:
+        flash("That profile no longer exists.", "danger")
+        return redirect(url_for('admin.profiles'))
+    return render_template('admin/profile.html', tab='perf', name=name, hotspots=profiling.hotspots(stats),
+            total_ms=round(stats.total_tt * 1000, 2), page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/profiles/<name>/flame.json")
+@login_required
+def profile_flame(name):
+    stats = profiling.load_stats(name)
+    if stats is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(profiling.flame_graph(stats))
+
+@bp.route("/admin/profiles/<name>/download")
+@login_required
+def profile_download(name):
+    if not profiling.PROFILE_NAME.match(name):
+        return redirect(url_for('admin.profiles'))
+    return send_from_directory(profiling.profile_dir(), name, as_attachment=True)
+
 @bp.route("/admin/logs/info")
 @login_required
 def textlogs():
-    return send_from_directory('../textlogs', 'flask_writer.log')
+    return render_template('admin/log-viewer.html', tab='logs', log_name='info', 
+            title='Text Logs', page=Page.query.filter_by(slug='admin').first())
 
 @bp.route("/admin/logs/error")
 @login_required
 def errorlogs():
-    return send_from_directory('../textlogs', 'flask_writer_errors.log')
+    return render_template('admin/log-viewer.html', tab='logs', log_name='error', 
+            title='Error Logs', page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/logs/audit")
+@login_required
+def auditlogs():
+    return render_template('admin/log-viewer.html', tab='logs', log_name='audit', 
+            title='Audit Logs', page=Page.query.filter_by(slug='admin').first())
+
+@bp.route("/admin/logs/<any(info, error, audit):name>/tail")
+@login_required
+def log_tail(name):
+    before = request.args.get('before', None, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify(log_files.tail(name, before, limit))
+
+@bp.route("/admin/logs/<any(info, error, audit):name>/search")
+@login_required
+def log_search(name):
+    return Response(stream_with_context(log_files.search(name, 
+            request.args.get('q', ''), request.args.get('level'))),
+            mimetype='application/x-ndjson')
+
+@bp.route("/admin/logs/<any(info, error, audit):name>/stream")
+@login_required
+def log_stream(name):
+    path = log_files.log_path(name)
+    if not os.path.exists(path):
+        return Response(status=204)
+    ## the stream can stay open for hours; give login_required's connection back first
+    db.session.remove()
+    return Response(log_files.follow(path), mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
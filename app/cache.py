@@ -0,0 +1,383 @@
+"""
+Full-page cache for anonymous readers.
+
+Public page views render the same HTML for every anonymous reader: the theme
+is picked in the browser and the nav comes from Page.nav(), so a reader with
+no session cookie never has the session opened. While a response renders,
+the model accessors it calls tag it with the rows they read (page:12 for a
+page, its children or its definitions, products for any product card, tag:3,
+nav). The tags go out as the Surrogate-Key header next to
+an explicit Cache-Control, and committing a change to any of those rows evicts
+exactly the entries that showed it.
+
+Entries live in an in-process LRU. PAGE_CACHE_DB adds a shared SQLite tier
+that the other workers on the host read on a local miss. Other workers learn
+about evictions through the invalidation bus: each entry keeps the
+generations of its tags and is dropped once any of them moves. With PURGE_URL
+set, the changed tags are also sent to a caching proxy in front of the app
+(e.g. Varnish with xkey) as a PURGE request.
+"""
+import time
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from flask import g, request, session, current_app, _request_ctx_stack
+from flask_login import current_user
+from sqlalchemy import inspect
+from app.invalidation import bus, tag
+from app.models import Page, Product, Definition, Link, Tag
+from app.metrics import cache_hit, cache_miss
+
+CACHEABLE_ENDPOINTS = {'page.home', 'page.index', 'page.shop', 'page.glossary'}
+STORED_HEADERS = ('Content-Type',)
+
+
+class MemoryTier(object):
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tags = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry['created'] > self.ttl:
+                self.discard(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = entry
+            for tag in entry['tags']:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.size:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            for tag in entry['tags']:
+                keys = self.tags.get(tag)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+    def remove(self, key):
+        with self.lock:
+            self.discard(key)
+
+    def evict(self, tags):
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys |= self.tags.get(tag, set())
+            for key in keys:
+                self.discard(key)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+
+class SQLiteTier(object):
+    """Shared by every worker on the host; each thread gets its own connection."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, status INTEGER, '
+                    'headers TEXT, body BLOB, created REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS entry_tag (tag TEXT, key TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entry_tag_tag ON entry_tag (tag)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entry_created ON entry (created)')
+
+    def connection(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+        return self.local.conn
+
+    def get(self, key):
+        row = self.connection().execute('SELECT status, headers, body, created FROM entry WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        tags = [r[0] for r in self.connection().execute('SELECT tag FROM entry_tag WHERE key = ?', (key,))]
+        return {'status': row[0], 'headers': json.loads(row[1]), 'body': row[2], 'created': row[3], 'tags': tags}
+
+    def set(self, key, entry):
+        conn = self.connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM entry_tag WHERE key = ?', (key,))
+            conn.execute('INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?)', (key, entry['status'],
+                    json.dumps(entry['headers']), entry['body'], entry['created']))
+            conn.executemany('INSERT INTO entry_tag VALUES (?, ?)', [(tag, key) for tag in entry['tags']])
+            conn.execute('DELETE FROM entry_tag WHERE key IN (SELECT key FROM entry ORDER BY created DESC '
+                    'LIMIT -1 OFFSET ?)', (self.size,))
+            conn.execute('DELETE FROM entry WHERE key IN (SELECT key FROM entry ORDER BY created DESC '
+                    'LIMIT -1 OFFSET ?)', (self.size,))
+
+    def evict(self, tags):
+        conn = self.connection()
+        marks = ','.join('?' * len(tags))
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            keys = [r[0] for r in conn.execute(f'SELECT DISTINCT key FROM entry_tag WHERE tag IN ({marks})',
+                    list(tags))]
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                batch_marks = ','.join('?' * len(batch))
+                conn.execute(f'DELETE FROM entry WHERE key IN ({batch_marks})', batch)
+                conn.execute(f'DELETE FROM entry_tag WHERE key IN ({batch_marks})', batch)
+        return len(keys)
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM entry')
+            conn.execute('DELETE FROM entry_tag')
+
+
+class PageCache(object):
+
+    def __init__(self):
+        self.memory = None
+        self.shared = None
+        self.max_age = 0
+        self.s_maxage = 0
+
+    def init_app(self, app):
+        self.max_age = app.config['PUBLIC_MAX_AGE']
+        self.s_maxage = app.config['PUBLIC_S_MAXAGE']
+        if app.config['PAGE_CACHE']:
+            self.memory = MemoryTier(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+            if app.config['PAGE_CACHE_DB']:
+                self.shared = SQLiteTier(app.config['PAGE_CACHE_DB'], app.config['PAGE_CACHE_SHARED_SIZE'])
+        app.before_request(self.lookup)
+        app.after_request(self.store)
+
+    def cacheable(self):
+        if request.method != 'GET' or request.endpoint not in CACHEABLE_ENDPOINTS or 'code' in request.args:
+            return False
+        if current_app.session_cookie_name not in request.cookies:
+            return True
+        return '_flashes' not in session and not current_user.is_authenticated
+
+    def key(self):
+        return '|'.join([request.host.lower(), request.full_path])
+
+    def public_headers(self, response, tags):
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.cache_control.s_maxage = self.s_maxage
+        response.headers['Surrogate-Key'] = ' '.join(tags)
+
+    def fresh(self, entry):
+        current = bus.current()
+        if entry['generation'] == current:
+            return True
+        if bus.generations(entry['tags']) == entry['tag_generations']:
+            entry['generation'] = current
+            return True
+        return False
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None and not self.fresh(entry):
+            self.memory.remove(key)
+            entry = None
+        if entry is None and self.shared is not None:
+            ## the committing worker evicts the shared tier before bumping, so what's left is current
+            current = bus.current()
+            entry = self.shared.get(key)
+            if entry is not None:
+                entry.update(generation=current, tag_generations=bus.generations(entry['tags']))
+                self.memory.set(key, entry)
+        return entry
+
+    def lookup(self):
+        if not self.cacheable():
+            return None
+        if current_app.session_cookie_name not in request.cookies:
+            ## answer current_user and get_flashed_messages() up front so the render never opens
+            ## the session, which would add Vary: Cookie
+            _request_ctx_stack.top.user = current_app.login_manager.anonymous_user()
+            _request_ctx_stack.top.flashes = []
+        if self.memory is not None:
+            key = self.key()
+            entry = self.get(key)
+            if entry is not None:
+                cache_hit('page')
+                response = current_app.response_class(entry['body'], status=entry['status'],
+                        headers=entry['headers'])
+                response.headers['X-Cache'] = 'HIT'
+                self.public_headers(response, entry['tags'])
+                return response
+            cache_miss('page')
+            g.page_cache_key = key
+            g.page_cache_generation = bus.current()
+        g.page_cache_tags = set()
+        return None
+
+    def store(self, response):
+        if response.is_streamed and 'page_cache_tags' in g:
+            return self.store_streamed(response)
+        tags = g.pop('page_cache_tags', None)
+        if tags is None:
+            if request.endpoint in CACHEABLE_ENDPOINTS and 'X-Cache' not in response.headers:
+                ## logged in, previewing with a code or carrying a flash message
+                response.cache_control.private = True
+                response.cache_control.no_store = True
+            return response
+        if response.status_code != 200 or response.direct_passthrough:
+            return response
+        tags = sorted(tags)
+        self.public_headers(response, tags)
+        key = g.pop('page_cache_key', None)
+        if key is None:
+            return response
+        if bus.current() != g.page_cache_generation:
+            ## something was committed while this rendered; it may be stale already
+            return response
+        self.save(key, response, response.get_data(), tags, g.page_cache_generation)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def store_streamed(self, response):
+        """
+        A streamed body renders after this runs, so its tags aren't known yet
+        and it's kept out of proxies. The page cache takes a copy once the last
+        chunk has gone out, and hits on it are served whole with their tags.
+        """
+        response.cache_control.private = True
+        response.cache_control.max_age = self.max_age
+        key = g.pop('page_cache_key', None)
+        if key is None or response.status_code != 200:
+            return response
+        ## still being filled in by tag() while the body renders
+        tags = g.page_cache_tags
+        generation = g.page_cache_generation
+        body = response.response
+        def tee():
+            chunks = []
+            try:
+                for chunk in body:
+                    chunks.append(chunk.encode(response.charset) if isinstance(chunk, str) else chunk)
+                    yield chunk
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            if bus.current() == generation:
+                self.save(key, response, b''.join(chunks), sorted(tags), generation)
+        response.response = tee()
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def save(self, key, response, body, tags, generation):
+        entry = {
+                'status': response.status_code,
+                'headers': {h: response.headers[h] for h in STORED_HEADERS if h in response.headers},
+                'body': body,
+                'tags': tags,
+                'generation': generation,
+                'tag_generations': bus.generations(tags),
+                'created': time.time(),
+            }
+        self.memory.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+
+    def evict(self, tags):
+        if self.memory is None or not tags:
+            return 0
+        evicted = self.memory.evict(tags)
+        if self.shared is not None:
+            evicted += self.shared.evict(tags)
+        return evicted
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+page_cache = PageCache()
+
+
+class Purger(object):
+    """Sends PURGE with the changed tags in PURGE_HEADER, off the committing thread."""
+
+    def __init__(self):
+        self.url = None
+
+    def init_app(self, app):
+        self.url = app.config['PURGE_URL']
+        self.header = app.config['PURGE_HEADER']
+        self.logger = app.logger
+
+    def __call__(self, tags):
+        if self.url and tags:
+            threading.Thread(target=self.send, args=(sorted(tags),), daemon=True).start()
+
+    def send(self, tags):
+        purge = urllib.request.Request(self.url, method='PURGE', headers={self.header: ' '.join(tags)})
+        try:
+            with urllib.request.urlopen(purge, timeout=5) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            self.logger.warning(f'Purging {len(tags)} keys at {self.url} failed: {e}')
+
+purge = Purger()
+
+
+@bus.tagger
+def changed_tags(target):
+    """Tags to evict when `target` is inserted, updated or deleted."""
+    if isinstance(target, Page):
+        tags = {f'page:{target.id}'}
+        attrs = inspect(target).attrs
+        history = attrs.parent_id.history
+        parent_ids = (history.added or []) + (history.deleted or []) + [target.parent_id]
+        tags |= {f'page:{parent_id}' for parent_id in parent_ids if parent_id}
+        history = attrs.published.history
+        if any((history.added or []) + (history.deleted or []) + [target.published]) and target.in_nav(parent_ids):
+            tags.add('nav')
+        ## glossaries list the pages under each tag
+        history = attrs.tags.history
+        tags |= {f'tag:{t.id}' for t in (history.added or []) + (history.deleted or []) if t.id}
+        return tags
+    if isinstance(target, Product):
+        return {f'product:{target.id}', 'products'}
+    if isinstance(target, Link):
+        return {f'product:{target.product_id}', 'products'}
+    if isinstance(target, Definition):
+        return {f'page:{target.parent_id}'}
+    if isinstance(target, Tag):
+        ## pages show their tags' names
+        return {f'tag:{target.id}'} | {f'page:{page.id}' for page in target.pages}
+    return set()
+
+@bus.listener
+def evict_changes(tags):
+    page_cache.evict(tags)
+    purge(tags)
+
+def init_app(app):
+    page_cache.init_app(app)
+    purge.init_app(app)
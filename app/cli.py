@@ -0,0 +1,105 @@
+import os
+import time
+import click
+from datetime import datetime, timedelta
+from app import db, export
+from app.models import PageVersion, ver_tags
+
+
+def expired_versions(versions, now, keep_days, daily_days):
+    """
+    Takes (id, edit_date) rows for one page, newest first, and returns the ids
+    that fall outside the retention policy: everything from the last keep_days,
+    the newest version of each day up to daily_days, then the newest of each week.
+    """
+    expired = []
+    kept_days = set()
+    kept_weeks = set()
+    for version in versions:
+        age = now - version.edit_date
+        if age <= timedelta(days=keep_days):
+            continue
+        if age <= timedelta(days=daily_days):
+            bucket, kept = version.edit_date.date(), kept_days
+        else:
+            bucket, kept = version.edit_date.isocalendar()[0:2], kept_weeks
+        if bucket in kept:
+            expired.append(version.id)
+        else:
+            kept.add(bucket)
+    return expired
+
+
+def register(app):
+
+    @app.cli.command('versions-compact')
+    @click.option('--keep-days', type=int, default=None,
+            help='Keep every version newer than this many days.')
+    @click.option('--daily-days', type=int, default=None,
+            help='Keep one version per day up to this many days, weekly after that.')
+    @click.option('--batch-size', type=int, default=None,
+            help='Versions deleted per transaction.')
+    @click.option('--pause', type=float, default=0.1,
+            help='Seconds to wait between batches.')
+    @click.option('--dry-run', is_flag=True, help='Report without deleting.')
+    @click.option('--vacuum', is_flag=True, help='VACUUM afterwards so the database file shrinks.')
+    def versions_compact(keep_days, daily_days, batch_size, pause, dry_run, vacuum):
+        """Delete old page versions according to the retention policy."""
+        keep_days = keep_days if keep_days is not None else app.config['VERSION_KEEP_DAYS']
+        daily_days = daily_days if daily_days is not None else app.config['VERSION_DAILY_DAYS']
+        batch_size = batch_size or app.config['VERSION_COMPACT_BATCH']
+        now = datetime.utcnow()
+        expired = []
+        page_ids = [row[0] for row in db.session.query(PageVersion.original_id).distinct()]
+        for page_id in page_ids:
+            versions = db.session.query(PageVersion.id, PageVersion.edit_date).filter_by(
+                    original_id=page_id).order_by(PageVersion.edit_date.desc()).all()
+            expired += expired_versions(versions, now, keep_days, daily_days)
+        db.session.commit()
+
+        ## length() counts characters; as a blob it counts bytes
+        size = sum(db.func.coalesce(db.func.length(db.cast(column, db.LargeBinary)), 0)
+                for column in (PageVersion.body, PageVersion.notes, PageVersion.sidebar))
+        removed = 0
+        reclaimed = 0
+        for start in range(0, len(expired), batch_size):
+            batch = expired[start:start + batch_size]
+            reclaimed += db.session.query(db.func.sum(size)).filter(
+                    PageVersion.id.in_(batch)).scalar() or 0
+            if not dry_run:
+                db.session.execute(ver_tags.delete().where(ver_tags.c.page_version_id.in_(batch)))
+                PageVersion.query.filter(PageVersion.id.in_(batch)).delete(synchronize_session=False)
+                db.session.commit()
+                time.sleep(pause)
+            removed += len(batch)
+        action = 'Would remove' if dry_run else 'Removed'
+        click.echo(f'{action} {removed} versions of {len(page_ids)} pages ({reclaimed} bytes of text).')
+        if not dry_run:
+            app.logger.info(f'Compacted page versions: {removed} removed, {reclaimed} bytes of text.')
+            if vacuum:
+                ## VACUUM can't run inside a transaction
+                with db.engine.connect() as conn:
+                    conn.execution_options(isolation_level='AUTOCOMMIT').execute(db.text('VACUUM'))
+                click.echo('Vacuumed the database.')
+            else:
+                click.echo('The space is reused for new rows; run with --vacuum to shrink the database file.')
+
+    @app.cli.command('export-static')
+    @click.option('--out', type=click.Path(file_okay=False), default=None,
+            help='Directory to write the site into.')
+    @click.option('--workers', type=int, default=None, help='Render threads.')
+    @click.option('--full', is_flag=True, help='Render everything, ignoring the last export.')
+    @click.option('--dry-run', is_flag=True, help='List what would be rendered or removed.')
+    def export_static(out, workers, full, dry_run):
+        """Pre-render the published site for nginx, re-rendering only what changed."""
+        out = out or app.config['STATIC_EXPORT_DIR']
+        workers = workers or app.config['STATIC_EXPORT_WORKERS']
+        os.makedirs(out, exist_ok=True)
+        start = time.perf_counter()
+        counts = export.export(out, workers, full, dry_run, echo=click.echo)
+        action = 'Would render' if dry_run else 'Rendered'
+        click.echo(f"{action} {counts['rendered']} URLs, removed {counts['removed']}, "
+                f"{counts['unchanged']} unchanged, {counts['failed']} failed "
+                f"({time.perf_counter() - start:.1f}s) in {out}")
+        if not dry_run:
+            app.logger.info(f'Static export: {counts}')
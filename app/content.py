@@ -0,0 +1,132 @@
+"""
+The content pipeline: one markdown source in, everything the site derives
+from it out.
+
+A Content runs the STAGES below in order, each reading what the ones before
+it left in `outputs`:
+
+    count       words in the source, before any markup is added
+    typography  --- to the sprig separator, -- to an em dash
+    markdown    splits the source into app.render's cached blocks
+    shortcodes  the whole HTML, with p[...] product cards and any other @shortcode
+    sanitize    the HTML minus scripts, styles and comments
+    extract     the plain text, for email bodies and search
+
+Stages only run as far as the output asked for needs, and at most once, so a
+word count never renders markdown. Blocks render as they're first asked for
+and are kept, so a streamed page's chunks, its excerpt (only the first few
+blocks) and its html all come from one render. The published HTML is the
+author's own and isn't sanitized; sanitize only keeps script and comment
+bodies out of the text.
+"""
+import re
+from app.render import render_markdown, render_blocks
+
+DASHES = re.compile(r'---|--')
+DASH = {'---': '<center>&#127793;</center>', '--': '&#8212;'}
+WORDS = re.compile(r"[a-zA-Z']+-?[a-zA-Z']*")
+HIDDEN = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->', re.DOTALL | re.IGNORECASE)
+TAG = re.compile(r'<.*?>')
+SHORTCODES = []
+
+
+def shortcode(pattern):
+    """Registers func(html) to run on rendered HTML in which `pattern` (a compiled regex) matches."""
+    def decorator(func):
+        SHORTCODES.append((pattern, func))
+        return func
+    return decorator
+
+def apply_shortcodes(html):
+    for pattern, func in SHORTCODES:
+        if pattern.search(html):
+            html = func(html)
+    return html
+
+def plain(html):
+    """The text of a piece of HTML, as sanitize and extract leave it."""
+    return TAG.sub('', HIDDEN.sub('', html))
+
+
+def count(content):
+    content.outputs['words'] = len(WORDS.findall(content.source))
+
+def typography(content):
+    content.outputs['markdown'] = DASHES.sub(lambda m: DASH[m.group()], content.source)
+
+def markdown(content):
+    text = content.outputs.get('markdown', content.source)
+    if any(len(pattern.findall(text)) > 1 for pattern, func in SHORTCODES):
+        ## a shortcode used twice may depend on the one before it, so those render whole
+        content.unrendered = (render_markdown(whole) for whole in [text])
+    else:
+        content.unrendered = render_blocks(text)
+    content.outputs['blocks'] = []
+
+def shortcodes(content):
+    content.outputs['html'] = ''.join(content.blocks())
+
+def sanitize(content):
+    content.outputs['visible'] = HIDDEN.sub('', content.outputs['html'])
+
+def extract(content):
+    content.outputs['text'] = TAG.sub('', content.outputs['visible'])
+
+STAGES = [count, typography, markdown, shortcodes, sanitize, extract]
+## Sidebars are rendered as written
+PLAIN = [stage for stage in STAGES if stage is not typography]
+
+
+class Content(object):
+
+    def __init__(self, source, stages=STAGES):
+        self.source = source or ''
+        self.outputs = {}
+        self.pending = list(stages)
+        ## the blocks markdown hasn't rendered yet
+        self.unrendered = iter(())
+
+    def get(self, name):
+        while name not in self.outputs and self.pending:
+            self.pending.pop(0)(self)
+        return self.outputs[name]
+
+    @property
+    def html(self):
+        return self.get('html')
+
+    @property
+    def text(self):
+        return self.get('text')
+
+    @property
+    def words(self):
+        return self.get('words')
+
+    def blocks(self):
+        """The HTML a markdown block at a time, each rendered once however many times it's read."""
+        rendered = self.get('blocks')
+        i = 0
+        while True:
+            if i == len(rendered):
+                html = next(self.unrendered, None)
+                if html is None:
+                    return
+                rendered.append(apply_shortcodes(html))
+            yield rendered[i]
+            i += 1
+
+    def excerpt(self, length=247):
+        """The first `length` characters of the text, from only as many blocks as that takes."""
+        if 'text' in self.outputs:
+            return self.text[:length] + '...'
+        text = ''
+        for html in self.blocks():
+            text += plain(html)
+            if len(text) >= length:
+                break
+        return text[:length] + '...'
+
+    def chunks(self):
+        """The HTML a markdown block at a time, for streamed pages."""
+        return self.blocks()
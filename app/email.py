@@ -2,10 +2,17 @@ from threading import Thread
 from flask import current_app
 from flask_mail import Message
 from app import mail
+from app.metrics import email_sent, email_failed
 
 def send_async_email(app, msg):
     with app.app_context():
-        mail.send(msg)
+        try:
+            mail.send(msg)
+        except Exception:
+            email_failed()
+            app.logger.exception("Failed to send email to: " + ", ".join(msg.recipients))
+            return
+        email_sent()
         app.logger.info("Emails sent to: " + ", ".join(msg.recipients))
 
 def send_email(subject, sender, recipients, text_body, html_body, 
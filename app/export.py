@@ -0,0 +1,193 @@
+"""
+Static export of the public site.
+
+Every exported URL records the keys it was rendered from: its own page, the
+pages it lists, its parent and siblings (next/prev and the TOC), the nav, the
+templates and any products it embeds. Each key has a fingerprint of the rows
+behind it, so a later export only re-renders URLs whose keys changed.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+from flask import current_app
+from app import db
+from app.models import Page, Tag, Definition, Product, Link, tags as page_tags
+
+PRODUCT_MARKUP = re.compile(r'p\[(\d*)\|')
+MANIFEST = '.export.json'
+FEED_TEMPLATES = ('chapter', 'post')
+
+
+def digest(*values):
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()[0:16]
+
+def template_state():
+    sha = hashlib.sha1()
+    for root, dirs, files in os.walk(current_app.config['TEMPLATE_DIR']):
+        dirs.sort()
+        for name in sorted(files):
+            sha.update(name.encode('utf-8'))
+            with open(os.path.join(root, name), 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()[0:16]
+
+def site_state():
+    """
+    Returns (state, graph, pages): the fingerprint of every key, the keys
+    each URL depends on and the published page rows for the sitemap.
+    """
+    pages = Page.query.with_entities(Page.id, Page.title, Page.slug, Page.path, Page.parent_id,
+            Page.template, Page.banner, Page.body, Page.summary, Page.sidebar, Page.sort,
+            Page.pub_date, Page.edit_date, Page.published).order_by(Page.id).all()
+    page_tag_names = defaultdict(list)
+    for page_id, name in db.session.query(page_tags.c.page_id, Tag.name).join(Tag, Tag.id == page_tags.c.tag_id):
+        page_tag_names[page_id].append(name)
+
+    state = {'templates': template_state()}
+    by_id = {p.id: p for p in pages}
+    children = defaultdict(list)
+    for p in pages:
+        state[f'page:{p.id}'] = digest(tuple(p), sorted(page_tag_names[p.id]))
+        if p.published:
+            children[p.parent_id].append(p)
+    for parent_id, kids in children.items():
+        state[f'listing:{parent_id}'] = digest(sorted((k.id, k.title, k.path, k.sort, k.pub_date, k.template)
+                for k in kids))
+    nav = [(p.id, p.title, p.path, p.sort, p.pub_date) for p in children[None]]
+    for top in children[None]:
+        for child in children[top.id]:
+            nav.append((child.id, child.title, child.path, child.sort, child.pub_date, top.id))
+            nav += [(g.id, g.title, g.path, g.sort, g.pub_date, child.id) for g in children[child.id]]
+    state['nav'] = digest(nav)
+
+    definitions = defaultdict(list)
+    for d in Definition.query.with_entities(Definition.id, Definition.name, Definition.body, Definition.hidden_body,
+            Definition.type, Definition.tag_id, Definition.parent_id, Definition.active).order_by(Definition.id):
+        definitions[d.parent_id].append(tuple(d))
+    for parent_id, rows in definitions.items():
+        state[f'definitions:{parent_id}'] = digest(rows)
+        state[f'has_glossary:{parent_id}'] = 'yes'
+
+    links = defaultdict(list)
+    for link in Link.query.with_entities(Link.product_id, Link.text, Link.url, Link.sort).order_by(Link.id):
+        links[link.product_id].append(tuple(link))
+    for product in Product.query.order_by(Product.id):
+        state[f'product:{product.id}'] = digest(product.id, product.name, product.price, product.description,
+                product.image, product.sort, product.active, links[product.id])
+    state['products'] = digest(sorted((k, v) for k, v in state.items() if k.startswith('product:')))
+
+    def page_deps(p):
+        deps = {'templates', 'nav', f'page:{p.id}', f'listing:{p.id}', f'has_glossary:{p.id}'}
+        deps.update(f'page:{c.id}' for c in children[p.id])
+        texts = [p.body or '', p.sidebar or '']
+        if p.parent_id:
+            deps.update({f'page:{p.parent_id}', f'listing:{p.parent_id}', f'has_glossary:{p.parent_id}'})
+            if p.parent_id in by_id:
+                texts.append(by_id[p.parent_id].sidebar or '')
+        for text in texts:
+            deps.update(f'product:{pid}' for pid in PRODUCT_MARKUP.findall(text))
+        return deps
+
+    graph = {}
+    published = [p for p in pages if p.published and p.path]
+    feed = [p for p in published if p.template in FEED_TEMPLATES]
+    for p in published:
+        graph[p.path] = page_deps(p)
+        if p.path == '/home':
+            graph['/'] = page_deps(p)
+        if p.id in definitions:
+            graph[f'{p.path}/glossary'] = {'templates', 'nav', f'page:{p.id}', f'definitions:{p.id}'}
+        kids = [c for c in children[p.id] if c.template in FEED_TEMPLATES]
+        if kids:
+            graph[f'/rss{p.path}'] = {'templates', f'page:{p.id}'} | {f'page:{c.id}' for c in kids}
+        if p.slug == 'shop':
+            graph['/shop'] = {'templates', 'nav', 'products', f'page:{p.id}'}
+        if p.slug == 'home':
+            graph['/rss/all'] = {'templates', f'page:{p.id}'} | {f'page:{c.id}' for c in feed}
+    return state, graph, published
+
+def output_path(out, url):
+    filename = 'index.xml' if url.startswith('/rss/') else 'index.html'
+    return os.path.join(out, url.strip('/'), filename)
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def write_sitemap(out, pages):
+    base = current_app.config['BASE_URL']
+    urls = [f'  <url><loc>{escape(base + p.path)}</loc>'
+            f'<lastmod>{(p.edit_date or p.pub_date or datetime.utcnow()).date().isoformat()}</lastmod></url>'
+            for p in pages]
+    write(os.path.join(out, 'sitemap.xml'), '\n'.join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+            *urls,
+            '</urlset>', '']).encode('utf-8'))
+
+def load_manifest(out):
+    try:
+        with open(os.path.join(out, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'state': {}, 'urls': {}}
+
+def export(out, workers=4, full=False, dry_run=False, echo=print):
+    """Renders stale URLs into `out` with a thread pool and returns counts."""
+    state, graph, pages = site_state()
+    manifest = load_manifest(out)
+    old_state = manifest['state']
+    changed = {key for key in set(state) | set(old_state) if state.get(key) != old_state.get(key)}
+    if full:
+        stale = sorted(graph)
+    else:
+        stale = sorted(url for url, deps in graph.items() if url not in manifest['urls']
+                or set(manifest['urls'][url]) != deps or deps & changed)
+    removed = sorted(set(manifest['urls']) - set(graph))
+    if dry_run:
+        for url in stale:
+            echo(f'render {url}')
+        for url in removed:
+            echo(f'remove {url}')
+        return {'rendered': len(stale), 'removed': len(removed), 'failed': 0, 'unchanged': len(graph) - len(stale)}
+
+    app = current_app._get_current_object()
+    local = threading.local()
+    def render(url):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        response = local.client.get(url)
+        if response.status_code != 200:
+            return url, response.status_code
+        write(output_path(out, url), response.get_data())
+        return url, 200
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for url, status in pool.map(render, stale):
+            if status != 200:
+                failed.append(url)
+                echo(f'{url} returned {status}')
+    for url in removed:
+        path = output_path(out, url)
+        if os.path.exists(path):
+            os.remove(path)
+    write_sitemap(out, pages)
+
+    urls = {url: sorted(deps) for url, deps in graph.items() if url not in failed}
+    write(os.path.join(out, MANIFEST), json.dumps({
+            'exported': datetime.utcnow().isoformat(),
+            'state': state,
+            'urls': urls,
+        }).encode('utf-8'))
+    return {'rendered': len(stale) - len(failed), 'removed': len(removed), 'failed': len(failed),
+            'unchanged': len(graph) - len(stale)}
@@ -0,0 +1,146 @@
+"""
+Cross-worker cache invalidation.
+
+After every commit the tags of the changed rows ("page", "page:12", plus
+anything registered with @bus.tagger) have their generation bumped in a small
+mmap'd file shared by every worker on the host. A cache remembers the
+generations it was built at and compares them on read. Slot 0 is a global
+generation that moves on any change, so the common case is one 8-byte read.
+
+Tags hash into a fixed number of slots; a collision only ever causes an
+extra invalidation, never a missed one.
+"""
+import os
+import mmap
+import zlib
+import fcntl
+import struct
+import threading
+from flask import g, has_request_context
+from sqlalchemy import event
+from app import db
+
+SLOTS = 4096
+COUNTER = struct.Struct('Q')
+
+
+class GenerationStore(object):
+    """
+    The file is opened once per process. flock() locks belong to the open
+    file, so workers forked from a preloaded app would otherwise share one
+    lock and never exclude each other; the threads of one process take
+    `lock` on top of it for the same reason.
+    """
+
+    def __init__(self, path, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        self.size = (slots + 1) * COUNTER.size
+        self.pid = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.open()
+
+    def open(self):
+        if self.pid == os.getpid():
+            return
+        self.lock = threading.Lock()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < self.size:
+            os.ftruncate(self.fd, self.size)
+        self.map = mmap.mmap(self.fd, self.size)
+        self.pid = os.getpid()
+
+    def offset(self, tag):
+        return (1 + zlib.crc32(tag.encode('utf-8')) % self.slots) * COUNTER.size
+
+    def current(self):
+        return COUNTER.unpack_from(self.map, 0)[0]
+
+    def get(self, tag):
+        return COUNTER.unpack_from(self.map, self.offset(tag))[0]
+
+    def bump(self, tags):
+        self.open()
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                for offset in {self.offset(tag) for tag in tags} | {0}:
+                    COUNTER.pack_into(self.map, offset, COUNTER.unpack_from(self.map, offset)[0] + 1)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class InvalidationBus(object):
+
+    def __init__(self):
+        self.store = None
+        self.taggers = []
+        self.listeners = []
+
+    def init_app(self, app):
+        self.store = GenerationStore(app.config['INVALIDATION_FILE'])
+
+    def tagger(self, func):
+        """Registers func(row) -> set of extra tags to invalidate when row changes."""
+        self.taggers.append(func)
+        return func
+
+    def listener(self, func):
+        """Registers func(tags), called in the committing worker before the bump."""
+        self.listeners.append(func)
+        return func
+
+    def tags_for(self, target):
+        table = getattr(target, '__tablename__', None) or target.__table__.name
+        tags = {table, f'{table}:{getattr(target, "id", None)}'}
+        for tagger in self.taggers:
+            tags |= tagger(target)
+        return tags
+
+    def current(self):
+        return self.store.current() if self.store else 0
+
+    def generation(self, tag):
+        return self.store.get(tag) if self.store else 0
+
+    def generations(self, tags):
+        return tuple(self.generation(tag) for tag in tags)
+
+    def publish(self, tags):
+        for listener in self.listeners:
+            listener(tags)
+        if self.store:
+            self.store.bump(tags)
+
+bus = InvalidationBus()
+
+
+def tag(*tags):
+    """
+    Records that the response being rendered shows `tags`, so the page cache
+    evicts it when any of them is published. Called by the model accessors
+    that read rows, since a row already in the session's identity map loads
+    without firing any event.
+    """
+    if has_request_context() and 'page_cache_tags' in g:
+        g.page_cache_tags.update(tags)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changes(session, flush_context):
+    tags = session.info.setdefault('invalidate', set())
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags |= bus.tags_for(target)
+
+@event.listens_for(db.session, 'after_commit')
+def publish_changes(session):
+    tags = session.info.pop('invalidate', None)
+    if tags:
+        bus.publish(tags)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('invalidate', None)
+
+def init_app(app):
+    bus.init_app(app)
@@ -0,0 +1,115 @@
+"""
+Prometheus metrics served at /metrics.
+
+With several worker processes, set `prometheus_multiproc_dir` to an empty,
+writable directory before the workers start. Each process then writes its
+samples to mmap-backed files there and a scrape aggregates all of them. Under
+gunicorn, also call `child_exit` from the config's child_exit hook so the
+files of dead workers are cleaned up.
+"""
+import os
+import time
+from flask import g, request, current_app, Response, abort
+from prometheus_client import (
+        Counter, Gauge, Histogram, CollectorRegistry, generate_latest, 
+        CONTENT_TYPE_LATEST, REGISTRY, multiprocess
+    )
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from app import db
+
+REQUEST_LATENCY = Histogram('flask_writer_request_seconds', 'Request latency', 
+        ['blueprint', 'endpoint'], 
+        buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+RESPONSES = Counter('flask_writer_responses_total', 'Responses by status', ['status'])
+DB_CHECKOUTS = Counter('flask_writer_db_checkouts_total', 'Connections checked out of the pool')
+DB_CONNECTS = Counter('flask_writer_db_connects_total', 'New DB connections opened by the pool')
+DB_CHECKED_OUT = Gauge('flask_writer_db_checked_out', 'Connections currently checked out', 
+        multiprocess_mode='livesum')
+CACHE_REQUESTS = Counter('flask_writer_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+EMAILS = Counter('flask_writer_emails_total', 'Email messages handed to the SMTP server', ['result'])
+
+
+def cache_hit(cache):
+    CACHE_REQUESTS.labels(cache, 'hit').inc()
+
+def cache_miss(cache):
+    CACHE_REQUESTS.labels(cache, 'miss').inc()
+
+def email_sent(count=1):
+    EMAILS.labels('sent').inc(count)
+
+def email_failed(count=1):
+    EMAILS.labels('failed').inc(count)
+
+
+@event.listens_for(Pool, 'connect')
+def pool_connect(dbapi_connection, connection_record):
+    DB_CONNECTS.inc()
+
+@event.listens_for(Pool, 'checkout')
+def pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CHECKOUTS.inc()
+    DB_CHECKED_OUT.inc()
+
+@event.listens_for(Pool, 'checkin')
+def pool_checkin(dbapi_connection, connection_record):
+    DB_CHECKED_OUT.dec()
+
+
+class ContentCollector(object):
+    """Site totals, queried when scraped so every worker reports the same value."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        from app.models import Page, Subscriber
+        with self.app.app_context():
+            subscribers = GaugeMetricFamily('flask_writer_subscribers', 'Subscribers')
+            subscribers.add_metric([], Subscriber.query.count())
+            pages = GaugeMetricFamily('flask_writer_pages', 'Pages by template and status', 
+                    labels=['template', 'published'])
+            for template, published, count in Page.query.with_entities(
+                    Page.template, Page.published, db.func.count(Page.id)
+                    ).group_by(Page.template, Page.published):
+                pages.add_metric([template or '', str(bool(published)).lower()], count)
+        yield subscribers
+        yield pages
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+
+def finish_request(response):
+    if 'metrics_start' in g and request.endpoint != 'metrics':
+        REQUEST_LATENCY.labels(request.blueprint or '', request.endpoint or 'unmatched').observe(
+                time.perf_counter() - g.metrics_start)
+    RESPONSES.labels(str(response.status_code)).inc()
+    return response
+
+def child_exit(server, worker):
+    if 'prometheus_multiproc_dir' in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    content = CollectorRegistry()
+    content.register(ContentCollector(app))
+
+    def metrics():
+        if request.remote_addr not in current_app.config['METRICS_ALLOWED_IPS']:
+            abort(404)
+        if 'prometheus_multiproc_dir' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry) + generate_latest(content), 
+                mimetype=CONTENT_TYPE_LATEST)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,16 +1,28 @@
-from flask import current_app, url_for, session, jsonify, render_template
+from flask import current_app, url_for, jsonify, render_template, g
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login
 from datetime import datetime
-from markdown import markdown
 from sqlalchemy import desc
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, lazyload, selectinload
 from flask_mail import Mail, Message
 from app import mail
 from app.email import send_email
+from app.content import Content, PLAIN, shortcode
+from app.invalidation import bus, tag as cache_tag
 import re
 import pytz
+from collections import defaultdict
+
+## Page.nav() is built once per change and shared by every request
+NAV = {}
+PRODUCT_MARKUP = re.compile(r'p\[(\d*)\|([a-zA-Z,]*)\]')
+## Loader options for lists of pages. Listings (blog, RSS) show each page's
+## tags and fall back to its parent's banner; outlines (tables of contents,
+## chapter lists, next/previous) only read the pages' own columns. Lazy
+## rather than noload: an outline can load a page that a listing later shows.
+LISTING = (selectinload('tags'), selectinload('parent'))
+OUTLINE = (lazyload('tags'),)
 
 tags = db.Table('tags',
     db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
@@ -79,13 +91,7 @@ class PageVersion(db.Model):
     edit_date = db.Column(db.DateTime(), index=True, default=datetime.utcnow)
 
     def word_count(self):
-        try:
-            return self.words
-        except:
-            words = len(re.findall("[a-zA-Z']+-?[a-zA-Z']*", self.body))
-            read_time = str(round(words / 200)) + " - " + str(round(words / 150)) + " mins."
-            self.words = words
-        return self.words
+        return Content(self.body).words
 
     def local_pub_date(self, tz):
         if self.pub_date:
@@ -103,18 +109,24 @@ class PageVersion(db.Model):
         return f"<PageVersion({self.id}, {self.title}, {self.path})>"
 
 class Page(db.Model):
+    __table_args__ = (
+            ## pub_children() / pub_siblings() / the nav: parent + published, ordered by sort
+            db.Index('ix_page_parent_published_sort', 'parent_id', 'published', 'sort', 'pub_date', 'title'),
+            ## blog and RSS listings: post/chapter templates by pub_date
+            db.Index('ix_page_template_published_pub_date', 'template', 'published', 'pub_date'),
+        )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    slug = db.Column(db.String(200), nullable=True)
+    slug = db.Column(db.String(200), index=True, nullable=True)
     dir_path = db.Column(db.String(500), nullable=True)
-    path = db.Column(db.String(500), nullable=True)
+    path = db.Column(db.String(500), index=True, nullable=True)
     parent_id = db.Column(db.Integer(), db.ForeignKey('page.id'), nullable=True)
     parent = db.relationship('Page', remote_side=[id], backref='children')
     template = db.Column(db.String(100))
     banner = db.Column(db.String(500), nullable=True)
     body = db.Column(db.String(10000000))
     notes = db.Column(db.Text(5000000))
-    tags = db.relationship('Tag', secondary=tags, lazy='subquery', 
+    tags = db.relationship('Tag', secondary=tags, lazy='select', 
             backref=db.backref('pages', order_by='Page.path', lazy=True))
     summary = db.Column(db.String(300), nullable=True)
     sidebar = db.Column(db.String(5000), nullable=True)
@@ -154,37 +166,42 @@ class Page(db.Model):
             self.path = f"/{self.slug}"
             self.dir_path = "/"
 
+    def content(self, field='body'):
+        """`field` through the content pipeline, reused until the field changes."""
+        cache_tag(f'page:{self.id}')
+        source = getattr(self, field) or ''
+        if not hasattr(self, 'processed'):
+            self.processed = {}
+        content = self.processed.get(field)
+        if content is None or content.source != source:
+            content = self.processed[field] = Content(source)
+        return content
+
     def html(self, field):
-        if field == 'body':
-            data = self.body
-        if field == 'notes':
-            data = self.notes
-        data = markdown(data.replace('---', '<center>&#127793;</center>').replace('--', '&#8212;'))
-        data = Product.replace_product_markup(data)
-        return data
+        return self.content(field).html
 
     def html_body(self):
-        body = markdown(self.body.replace('---', '<center>&#127793;</center>').replace('--', '&#8212;'))
-        body = Product.replace_product_markup(body)
-        return body
+        return self.content().html
+
+    def html_body_chunks(self):
+        """html_body() a markdown block at a time, for streamed pages."""
+        return self.content().chunks()
 
     def text_body(self):
-        pattern = re.compile(r'<.*?>')
-        return pattern.sub('', self.html_body())
+        return self.content().text
 
     def html_sidebar(self):
         sidebar = self.sidebar
         if self.template == 'chapter' or self.template == 'post':
             if self.parent_id:
+                cache_tag(f'page:{self.parent_id}')
                 sidebar = self.parent.sidebar
-        sidebar = markdown(sidebar)
-        sidebar = Product.replace_product_markup(sidebar)
-        return sidebar
+        return Content(sidebar, PLAIN).html
     
     def description(self, length=247):
         if self.summary:
             return self.summary
-        return self.text_body()[0:length] + '...'
+        return self.content().excerpt(length)
 
     def view_code(self):
         #return str(datetime.now().year) + str(datetime.now().isocalendar()[1]) + self.slug
@@ -204,6 +221,7 @@ class Page(db.Model):
         banner = self.banner 
         if not self.banner and (self.template == 'chapter' or self.template == 'post'):
             if self.parent_id:
+                cache_tag(f'page:{self.parent_id}')
                 banner = self.parent.banner 
         if banner:
             if 'http' in banner[0:5]:
@@ -223,10 +241,14 @@ class Page(db.Model):
     def section_name(self):
         if self.template == 'chapter' or self.template == 'post':
             if self.parent_id:
+                cache_tag(f'page:{self.parent_id}')
                 return self.parent.title
         return self.title
 
-    def pub_children(self, published_only=True, chapter_post_only=False):
+    def pub_children(self, published_only=True, chapter_post_only=False, listing=False):
+        ## a child's change also bumps its parent's tag
+        cache_tag(f'page:{self.id}')
+        load = LISTING if listing else OUTLINE
         if published_only:
             if chapter_post_only:
                 return Page.query.filter(
@@ -234,20 +256,20 @@ class Page(db.Model):
                     ).filter_by(
                             parent_id=self.id,
                             published=True
-                    ).order_by('sort','pub_date','title').all()
+                    ).options(*load).order_by('sort','pub_date','title').all()
             return Page.query.filter_by(
                         parent_id=self.id,
                         published=True
-                ).order_by('sort','pub_date','title').all()
+                ).options(*load).order_by('sort','pub_date','title').all()
         if chapter_post_only:
             return Page.query.filter(
                     Page.template.in_(['chapter','post'])
                 ).filter_by(
                         parent_id=self.id,
-                ).order_by('sort','pub_date','title').all()
+                ).options(*load).order_by('sort','pub_date','title').all()
         return Page.query.filter_by(
                     parent_id=self.id,
-            ).order_by('sort','pub_date','title').all()
+            ).options(*load).order_by('sort','pub_date','title').all()
 
     def latest(self):
         if self.template == 'chapter' or self.template == 'post':
@@ -255,6 +277,7 @@ class Page(db.Model):
         return self.pub_children(chapter_post_only=True)[::-1][0]
 
     def pub_siblings(self, published_only=True, chapter_post_only=False):
+        cache_tag(f'page:{self.parent_id}')
         if published_only: 
             if chapter_post_only:
                 return Page.query.filter(
@@ -262,18 +285,18 @@ class Page(db.Model):
                     ).filter_by(
                         parent_id=self.parent_id,
                         published=True
-                    ).order_by('sort','pub_date','title').all()
+                    ).options(*OUTLINE).order_by('sort','pub_date','title').all()
             return Page.query.filter_by(
                     parent_id=self.parent_id,
                     published=True
-                ).order_by('sort','pub_date','title').all()
+                ).options(*OUTLINE).order_by('sort','pub_date','title').all()
         if chapter_post_only:
             return Page.query.filter(
                     Page.template.in_(['chapter','post'])
                 ).filter_by(
                     parent_id=self.parent_id
-                ).order_by('sort','title','pub_date').all()
-        return Page.query.filter_by(parent_id=self.parent_id).order_by('sort','title','pub_date').all()
+                ).options(*OUTLINE).order_by('sort','title','pub_date').all()
+        return Page.query.filter_by(parent_id=self.parent_id).options(*OUTLINE).order_by('sort','title','pub_date').all()
 
     def child_count(self, include_unpublished=False):
         if include_unpublished:
@@ -318,6 +341,7 @@ class Page(db.Model):
             return None
 
     def ancestors(self):
+        cache_tag(f'page:{self.parent_id}')
         ancestors = []
         parent = Page.query.filter_by(id=self.parent_id).first()
         if parent:
@@ -336,13 +360,7 @@ class Page(db.Model):
         return descendents
 
     def word_count(self):
-        try:
-            return self.words
-        except:
-            words = len(re.findall("[a-zA-Z']+-?[a-zA-Z']*", self.body))
-            read_time = str(round(words / 200)) + " - " + str(round(words / 150)) + " mins."
-            self.words = words
-        return self.words
+        return self.content().words
 
     def read_time(self):
         words = self.word_count()
@@ -430,34 +448,35 @@ class Page(db.Model):
         nav = []
         return nav
 
-    def set_nav():
-        nav = []
-        top_pages = Page.query.filter_by(published=True,parent_id=None).order_by('sort','pub_date','title').all()
-        for top_page in top_pages:
-            page = {
-                    'id': top_page.id,
-                    'title': top_page.title,
-                    'path': top_page.path,
-                    'children': [],
-                }
-            for child in top_page.pub_children():
-                kid = {
-                        'id': child.id,
-                        'title': child.title,
-                        'path': child.path,
-                        'children': [],
-                    }
-                for grandchild in child.pub_children():
-                    kid['children'].append({
-                            'id': grandchild.id,
-                            'title': grandchild.title,
-                            'path': grandchild.path,
-                            'children': [],
-                         })
-                page['children'].append(kid)
-            nav.append(page)
-        session['nav'] = nav
-
+    def nav():
+        """The top three levels of published pages, rebuilt when any page changes."""
+        generation = bus.generation('page')
+        if NAV.get('generation') != generation:
+            rows = Page.query.with_entities(Page.id, Page.title, Page.path, Page.parent_id).filter_by(
+                    published=True).order_by('sort','pub_date','title').all()
+            children = defaultdict(list)
+            for row in rows:
+                children[row.parent_id].append(row)
+            ids = set()
+            def branch(parent_id, depth):
+                items = []
+                for row in children[parent_id]:
+                    ids.add(row.id)
+                    items.append({
+                            'id': row.id,
+                            'title': row.title,
+                            'path': row.path,
+                            'children': branch(row.id, depth - 1) if depth > 1 else [],
+                        })
+                return items
+            NAV.update(nav=branch(None, 3), ids=ids, generation=generation)
+        return NAV['nav']
+
+    def in_nav(self, parent_ids=()):
+        """Whether a change to this page could show in the nav, judged by the last one built."""
+        if 'ids' not in NAV:
+            return True
+        return self.id in NAV['ids'] or any(p is None or p in NAV['ids'] for p in parent_ids)
 
     def __str__(self):
         return f"{self.title} ({self.path})"
@@ -482,7 +501,7 @@ class Subscriber(db.Model):
     first_name = db.Column(db.String(75), nullable=True)
     last_name = db.Column(db.String(75), nullable=True)
     subscription = db.Column(db.String(100), nullable=False, default='all')
-    sub_date = db.Column(db.DateTime(), default=datetime.utcnow)
+    sub_date = db.Column(db.DateTime(), index=True, default=datetime.utcnow)
 
     SUBSCRIPTION_CHOICES = [
             #('all','All'),
@@ -504,7 +523,11 @@ class Subscriber(db.Model):
         return self.email + current_app.config['SECRET_KEY']
 
     def gen_update_code(self):
-        return generate_password_hash(self.update_code())
+        try:
+            return self.update_code_hash
+        except AttributeError:
+            self.update_code_hash = generate_password_hash(self.update_code())
+        return self.update_code_hash
 
     def check_update_code(self, code):
         if code:
@@ -555,15 +578,26 @@ class Definition(db.Model):
     active = db.Column(db.Boolean, default=True)
 
     def html_body(self, hidden=False):
-        body = self.hidden_body if hidden else self.body
-        if body is None:
-            body = ''
-        return markdown(body.replace('---', '<center>&#127793;</center>').replace('--', '&#8212;'))
+        cache_tag(f'page:{self.parent_id}')
+        return Content(self.hidden_body if hidden else self.body).html
 
     def text_body(self, hidden=False):
-        body = self.html_body(hidden)
-        pattern = re.compile(r'<.*?>')
-        return pattern.sub('', body)
+        cache_tag(f'page:{self.parent_id}')
+        return Content(self.hidden_body if hidden else self.body).text
+
+    def tagged_pages(self):
+        """The pages carrying this definition's tag."""
+        if not self.tag_id:
+            return []
+        pages = self.tag.pages
+        cache_tag(f'tag:{self.tag_id}', *[f'page:{page.id}' for page in pages])
+        return pages
+
+    def mention_count(self):
+        if not self.tag_id:
+            return 0
+        return db.session.query(db.func.count()).select_from(tags).filter(
+                tags.c.tag_id == self.tag_id).scalar()
 
     def short_body(self):
         threshold = 37
@@ -615,16 +649,23 @@ class Product(db.Model):
                 hide=hide,
             )
 
+    def by_id():
+        """Every product with its links, loaded once per request for the cards."""
+        cache_tag('products')
+        if 'products' not in g:
+            g.products = {p.id: p for p in Product.query.options(selectinload('links'))}
+        return g.products
+
     def replace_product_markup(text, hide=[]):
         result = text
-        matches = re.findall('p\[(\d*)\|([a-zA-Z,]*)\]', text)
+        matches = PRODUCT_MARKUP.findall(text)
         current_app.logger.debug(f'MATCHES: {matches}')
         for match in matches:
             pid = match[0]
             current_app.logger.debug(f'PID: {pid}')
             hide = hide + match[1].split(',')
             current_app.logger.debug(f'HIDE: {hide}')
-            product = Product.query.filter_by(id = pid).first()
+            product = Product.by_id().get(int(pid or 0))
             if product:
                 result = result.replace(f'p[{pid}|{match[1]}]', product.card(hide=hide))
                 #current_app.logger.debug(result)
@@ -638,6 +679,10 @@ class Product(db.Model):
     def __repr__(self):
         return f"<Product({self.id}, {self.name})>"
 
+@shortcode(PRODUCT_MARKUP)
+def product_cards(html):
+    return Product.replace_product_markup(html)
+
 class Record(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     words = db.Column(db.Integer)
@@ -647,8 +692,8 @@ class Record(db.Model):
     comment = db.Column(db.String(200))
     minutes = db.Column(db.Integer)
     words_per_minute = db.Column(db.Integer)
-    date = db.Column(db.Date, default=datetime.now)
-    created = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.Date, index=True, default=datetime.now)
+    created = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
     def words_by_day(day):
         records = Record.query.filter_by(date=day).order_by(desc('words')).all()
@@ -1,31 +1,29 @@
 from flask import (
         render_template, redirect, url_for, flash, session, request, 
-        current_app, make_response, send_from_directory
+        current_app, make_response, send_from_directory, Response, stream_with_context
     )
 from app.page import bp
 from app.page.forms import SearchForm, SubscribeForm, SubscriptionForm
 from sqlalchemy import or_, desc
-from app.models import Page, Tag, Subscriber, Definition, Link, Product
+from sqlalchemy.orm import selectinload
+from app.models import Page, Tag, Subscriber, Definition, Link, Product, LISTING
 from app import db
+from app import cache
+from app.render import stream_template
 
 @bp.route('/')
 def home():
-    Page.set_nav()
     page = Page.query.filter_by(path='/home',published=True).first()
     if page:
+        cache.tag(f'page:{page.id}')
         return render_template(f'page/{page.template}.html', page=page)
     return render_template('home.html', page='page')
 
 @bp.route('/set-theme')
 @bp.route('/set-theme/<string:theme>')
 def set_theme(theme=None):
-    if theme:
-        session['theme'] = theme
-    elif 'theme' in session and session['theme'] == 'dark':
-        session['theme'] = 'light'
-    else:
-        session['theme'] = 'dark'
-    prev_path = request.args['path']
+    ## The theme is toggled in the browser; this only keeps old links and no-JS clicks working
+    prev_path = request.args.get('path')
     if prev_path:
         return redirect(prev_path)
     return redirect(url_for('page.home'))
@@ -35,7 +33,6 @@ def set_theme(theme=None):
 @bp.route('/search/keyword/<string:keyword>', methods=['GET', 'POST'])
 @bp.route('/search/keyword', methods=['GET','POST'])
 def search(tag=None,keyword=None):
-    Page.set_nav()
     tags = Tag.query.filter(Tag.pages != None).order_by('name').all()
     form = SearchForm()
     results = None
@@ -52,12 +49,12 @@ def search(tag=None,keyword=None):
         results = Page.query.filter(
                 Page.tags.any(name=tag), 
                 Page.published == True
-            ).order_by('sort','pub_date','title').all()
+            ).options(selectinload('tags')).order_by('sort','pub_date','title').all()
     if keyword:
         results = Page.query.filter(
                 Page.body.ilike(f'%{keyword}%'),
                 Page.published == True
-            ).order_by('sort','pub_date','title').all()
+            ).options(selectinload('tags')).order_by('sort','pub_date','title').all()
     return render_template('page/search.html',
             form=form,
             keyword=keyword,
@@ -69,7 +66,6 @@ def search(tag=None,keyword=None):
 
 @bp.route('/subscribe', methods=['GET','POST'])
 def subscribe():
-    Page.set_nav()
     form = SubscribeForm()
     form.subscription.choices = Subscriber.SUBSCRIPTION_CHOICES
     for field in form:
@@ -106,7 +102,6 @@ def subscribe():
 def subscription(email, code):
     sub = Subscriber.query.filter_by(email=email).first()
     if sub and sub.check_update_code(code):
-        Page.set_nav()
         form = SubscriptionForm()
         form.subscription.choices = Subscriber.SUBSCRIPTION_CHOICES
         choices = [c[0] for c in form.subscription.choices]
@@ -160,11 +155,11 @@ def rss(path):
     posts = None
     if path == '/all':
         page = Page.query.filter_by(slug='home').first()
-        posts = Page.query.filter(or_(Page.template == 'post',Page.template == 'chapter'), Page.published == True).order_by(desc('pub_date')).all()
+        posts = Page.query.filter(or_(Page.template == 'post',Page.template == 'chapter'), Page.published == True).options(*LISTING).order_by(desc('pub_date')).all()
         current_app.logger.debug(posts)
     else:
         page = Page.query.filter_by(path=path,published=True).first()
-        posts = Page.query.filter(or_(Page.template == 'post',Page.template == 'chapter'), Page.published == True, Page.parent_id == page.id).order_by(desc('pub_date')).all()
+        posts = Page.query.filter(or_(Page.template == 'post',Page.template == 'chapter'), Page.published == True, Page.parent_id == page.id).options(*LISTING).order_by(desc('pub_date')).all()
     if page:
         return render_template(f'page/rss.xml', page=page, posts=posts)
         rss_xml = render_template(f'page/rss.xml', page=page)
@@ -176,10 +171,10 @@ def rss(path):
 
 @bp.route('/shop')
 def shop():
-    Page.set_nav()
     products = Product.query.filter_by(active=True).order_by('sort','name').all()
     page = Page.query.filter_by(slug='shop').first()
     if products and page:
+        cache.tag(f'page:{page.id}', 'products')
         return render_template(f'page/shop.html', 
                 page=page,
                 products=products,
@@ -190,7 +185,6 @@ def shop():
 
 @bp.route('/<path:path>/glossary')
 def glossary(path):
-    Page.set_nav()
     path = f"/{path}"
     page = Page.query.filter_by(path=path).first()
     definitions = {}
@@ -203,6 +197,8 @@ def glossary(path):
             definitions[d.type.title()] += [d]
         code = request.args['code'] if 'code' in request.args else None
         if page.published or page.check_view_code(code):
+            ## its definitions bump the page's tag too
+            cache.tag(f'page:{page.id}')
             return render_template(f'page/glossary.html', 
                     page=page, 
                     glossary=True,
@@ -217,7 +213,6 @@ def glossary(path):
 
 @bp.route('/<path:path>/latest')
 def latest(path):
-    Page.set_nav()
     path = f"/{path}"
     page = Page.query.filter_by(path=path).first()
     return redirect(url_for('page.index', path=page.latest().path))
@@ -225,7 +220,6 @@ def latest(path):
 
 @bp.route('/<path:path>')
 def index(path):
-    Page.set_nav()
     current_app.logger.debug(request.host_url)
     current_app.logger.debug(request.host.lower())
     if request.host.lower() == "sprig.houstonhare.com":
@@ -238,10 +232,26 @@ def index(path):
     if page:
         code = request.args['code'] if 'code' in request.args else None
         if page.published or page.check_view_code(code):
+            cache.tag(f'page:{page.id}')
+            if streamed(page):
+                return Response(stream_with_context(stream_template(f'page/{page.template}.html', page=page)))
             return render_template(f'page/{page.template}.html', page=page)    
     page = Page.query.filter_by(slug='404-error').first()
     return render_template(f'page/{page.template}.html', page=page), 404
 
-@bp.before_app_first_request
-def set_nav():
-    Page.set_nav()
+def streamed(page):
+    """Long pages and story tables of contents go out as they render."""
+    if not current_app.config['STREAM_PAGES']:
+        return False
+    ## base.html reads flashed messages after the headers, and the session with them, have gone out
+    if current_app.session_cookie_name in request.cookies and '_flashes' in session:
+        return False
+    return page.template == 'story' or len(page.body or '') >= current_app.config['STREAM_MIN_CHARS']
+
+@bp.app_context_processor
+def inject_nav():
+    return {'nav': nav}
+
+def nav():
+    cache.tag('nav')
+    return Page.nav()
@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import time
+import json
+import bisect
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from contextlib import ContextDecorator
+from functools import wraps
+from collections import defaultdict, Counter
+from flask import (
+        g, request, current_app, has_request_context, before_render_template, 
+        template_rendered
+    )
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+## Geometric buckets from 0.1 to ~500,000 (ms or query counts); 25% apart
+BUCKETS = [0.1 * 1.25 ** i for i in range(70)]
+METRICS = ['wall_ms', 'sql_ms', 'queries', 'template_ms', 'markdown_ms']
+PERF_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(PERF_FILE)
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+SQL_SPACE = re.compile(r'\s+')
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+slow_query_logger = logging.getLogger('app.slow_queries')
+slow_query_ms = None
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        target = self.count * p / 100
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0.0
+
+    def summary(self):
+        return {
+                'count': self.count,
+                'mean': round(self.total / self.count, 2) if self.count else 0,
+                'p50': round(self.percentile(50), 2),
+                'p90': round(self.percentile(90), 2),
+                'p99': round(self.percentile(99), 2),
+                'max': round(self.max, 2),
+            }
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: {metric: Histogram() for metric in METRICS})
+
+    def record(self, endpoint, values):
+        with self.lock:
+            histograms = self.endpoints[endpoint]
+            for metric, value in values.items():
+                histograms[metric].observe(value)
+
+    def summary(self):
+        with self.lock:
+            return {endpoint: {metric: h.summary() for metric, h in histograms.items()}
+                    for endpoint, histograms in self.endpoints.items()}
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+stats = RequestStats()
+
+
+def normalize_sql(statement):
+    statement = SQL_LITERALS.sub('?', statement.replace('%s', '?'))
+    statement = SQL_LISTS.sub('(?...)', statement)
+    return SQL_SPACE.sub(' ', statement).strip()
+
+def call_site():
+    """The innermost frame in app code (templates included) that isn't this module."""
+    frame = sys._getframe(2)
+    while frame:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(APP_DIR) and filename != PERF_FILE:
+            return f'{os.path.relpath(filename, APP_DIR)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryTracker(ContextDecorator):
+    """
+    Counts statements by normalized SQL and call site while active.
+    As a context manager or decorator it fails when more than `budget`
+    statements run inside it:
+
+        with QueryTracker(budget=5):
+            client.get('/stories/sprig')
+    """
+    active = threading.local()
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.statements = Counter()
+
+    @property
+    def total(self):
+        return sum(self.statements.values())
+
+    def record(self, statement):
+        self.statements[(normalize_sql(statement), call_site())] += 1
+
+    def repeated(self, threshold):
+        return [(sql, site, count) for (sql, site), count in self.statements.most_common() 
+                if count > threshold]
+
+    def report(self):
+        return '\n'.join(f'    {count}x {site}: {sql}' for (sql, site), count in 
+                self.statements.most_common())
+
+    def __enter__(self):
+        self.statements = Counter()
+        if not hasattr(self.active, 'trackers'):
+            self.active.trackers = []
+        self.active.trackers.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.active.trackers.remove(self)
+        if self.budget is not None and exc[0] is None and self.total > self.budget:
+            raise AssertionError(f'{self.total} queries exceeded the budget of {self.budget}:\n'
+                    f'{self.report()}')
+        return False
+
+query_budget = QueryTracker
+
+
+def add(metric, value):
+    if has_request_context() and 'perf' in g:
+        g.perf[metric] += value
+
+def instrument(metric):
+    """Adds the wrapped function's run time (ms) to `metric` for the current request."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(metric, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('perf_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info['perf_start'].pop()) * 1000
+    add('sql_ms', elapsed)
+    add('queries', 1)
+    for tracker in getattr(QueryTracker.active, 'trackers', ()):
+        tracker.record(statement)
+    if slow_query_ms is not None and elapsed >= slow_query_ms:
+        log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+def param_shape(parameters):
+    """Types of the bound parameters, never their values."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+def explain(conn, statement, parameters):
+    prefix = EXPLAIN.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    ## a raw DBAPI cursor keeps the EXPLAIN out of the engine events
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [' | '.join(str(col) for col in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        cursor.close()
+
+def log_slow_query(conn, statement, parameters, executemany, elapsed):
+    slow_query_logger.info(json.dumps({
+            'time': datetime.utcnow().isoformat(),
+            'ms': round(elapsed, 2),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'path': request.path if has_request_context() else None,
+            'site': call_site(),
+            'sql': normalize_sql(statement),
+            'params': param_shape(parameters[0] if executemany and parameters else parameters),
+            'plan': None if executemany else explain(conn, statement, parameters),
+        }))
+
+
+def template_started(sender, template, context, **extra):
+    if 'perf' in g:
+        g.perf_templates.append(time.perf_counter())
+
+def template_finished(sender, template, context, **extra):
+    ## render_template can be nested (product cards), only the outermost call counts
+    if 'perf' in g and g.perf_templates:
+        start = g.perf_templates.pop()
+        if not g.perf_templates:
+            g.perf['template_ms'] += (time.perf_counter() - start) * 1000
+
+def start_request():
+    g.perf = {'sql_ms': 0, 'queries': 0, 'template_ms': 0, 'markdown_ms': 0}
+    g.perf_templates = []
+    g.perf_start = time.perf_counter()
+    if current_app.config['QUERY_TRACKING']:
+        g.query_tracker = QueryTracker().__enter__()
+
+def record_request(endpoint, perf, start):
+    perf['wall_ms'] = (time.perf_counter() - start) * 1000
+    stats.record(endpoint, perf)
+
+def finish_request(response):
+    if 'perf' not in g:
+        return response
+    g.perf['wall_ms'] = (time.perf_counter() - g.perf_start) * 1000
+    ## a streamed body hasn't rendered yet, so the request is recorded when the server closes it
+    endpoint, perf, start = request.endpoint or 'unmatched', g.perf, g.perf_start
+    response.call_on_close(lambda: record_request(endpoint, perf, start))
+    if current_app.config['PERF_SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join([
+                f"app;dur={g.perf['wall_ms']:.1f}",
+                f"db;dur={g.perf['sql_ms']:.1f};desc=\"{g.perf['queries']} queries\"",
+                f"tpl;dur={g.perf['template_ms']:.1f}",
+                f"md;dur={g.perf['markdown_ms']:.1f}",
+            ])
+    return response
+
+def stop_tracking(exc):
+    """Runs at teardown, after a streamed body has rendered and even when the view raised."""
+    tracker = g.pop('query_tracker', None)
+    if tracker is None:
+        return
+    tracker.__exit__(None, None, None)
+    for sql, site, count in tracker.repeated(current_app.config['QUERY_REPEAT_THRESHOLD']):
+        current_app.logger.warning(f'Possible N+1 in {request.endpoint}: {count}x at {site}: {sql}')
+
+def init_slow_query_log(app):
+    global slow_query_ms
+    slow_query_ms = app.config['SLOW_QUERY_MS']
+    if not slow_query_logger.handlers:
+        os.makedirs(app.config['LOG_DIR'], exist_ok=True)
+        handler = RotatingFileHandler(os.path.join(app.config['LOG_DIR'], 'flask_writer_slow_queries.log'),
+                maxBytes=app.config['SLOW_QUERY_LOG_BYTES'], backupCount=1)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.setLevel(logging.INFO)
+        slow_query_logger.propagate = False
+
+def init_app(app):
+    if app.config['SLOW_QUERY_LOG']:
+        init_slow_query_log(app)
+    if not app.config['PERF_ENABLED']:
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(stop_tracking)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
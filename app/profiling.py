@@ -0,0 +1,144 @@
+"""
+Sampled cProfile capture of live requests, toggled from the admin.
+
+Settings live in DATA_DIR/profiles/settings.json so every worker picks up a
+change on its next request without a restart. Captured profiles are written
+next to it and pruned to PROFILE_MAX_FILES / PROFILE_MAX_BYTES.
+"""
+import os
+import re
+import json
+import time
+import random
+import pstats
+import cProfile
+from flask import g, request, current_app
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.prof$')
+DEFAULT_SETTINGS = {'enabled': False, 'sample_rate': 0.01, 'path_pattern': ''}
+_settings = {'mtime': None, 'values': dict(DEFAULT_SETTINGS), 'pattern': None}
+
+
+def profile_dir():
+    return os.path.join(current_app.config['DATA_DIR'], 'profiles')
+
+def settings_path():
+    return os.path.join(profile_dir(), 'settings.json')
+
+def load_settings():
+    try:
+        mtime = os.stat(settings_path()).st_mtime
+    except OSError:
+        return _settings['values']
+    if mtime != _settings['mtime']:
+        with open(settings_path()) as f:
+            values = dict(DEFAULT_SETTINGS, **json.load(f))
+        _settings.update(mtime=mtime, values=values, 
+                pattern=re.compile(values['path_pattern']) if values['path_pattern'] else None)
+    return _settings['values']
+
+def save_settings(enabled, sample_rate, path_pattern):
+    os.makedirs(profile_dir(), exist_ok=True)
+    tmp = settings_path() + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'enabled': enabled, 'sample_rate': sample_rate, 'path_pattern': path_pattern}, f)
+    os.replace(tmp, settings_path())
+
+def should_profile():
+    settings = load_settings()
+    if not settings['enabled'] or request.path.startswith('/admin/profiles'):
+        return False
+    if _settings['pattern'] is not None:
+        return bool(_settings['pattern'].search(request.path))
+    return random.random() < settings['sample_rate']
+
+def start_request():
+    if should_profile():
+        g.profiler = cProfile.Profile()
+        g.profile_start = time.perf_counter()
+        g.profiler.enable()
+
+def finish_request(exc):
+    """Runs at teardown, so a streamed body is profiled too and a failing view still stops the profiler."""
+    if 'profiler' not in g:
+        return
+    g.profiler.disable()
+    elapsed = int((time.perf_counter() - g.profile_start) * 1000)
+    slug = re.sub(r'[^\w-]+', '-', request.path).strip('-')[0:80] or 'home'
+    os.makedirs(profile_dir(), exist_ok=True)
+    g.profiler.dump_stats(os.path.join(profile_dir(), 
+            f'{int(time.time() * 1000)}_{elapsed}ms_{slug}.prof'))
+    prune()
+
+def profiles():
+    if not os.path.isdir(profile_dir()):
+        return []
+    entries = []
+    for name in os.listdir(profile_dir()):
+        if PROFILE_NAME.match(name):
+            stamp, elapsed, slug = name[:-5].split('_', 2)
+            entries.append({
+                    'name': name,
+                    'date': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(stamp) / 1000)),
+                    'elapsed': int(elapsed[:-2]),
+                    'path': '/' + slug,
+                    'size': os.path.getsize(os.path.join(profile_dir(), name)),
+                })
+    return sorted(entries, key=lambda e: e['name'], reverse=True)
+
+def prune():
+    total = 0
+    for i, entry in enumerate(profiles()):
+        total += entry['size']
+        if i >= current_app.config['PROFILE_MAX_FILES'] or total > current_app.config['PROFILE_MAX_BYTES']:
+            os.remove(os.path.join(profile_dir(), entry['name']))
+
+def load_stats(name):
+    if not PROFILE_NAME.match(name) or not os.path.exists(os.path.join(profile_dir(), name)):
+        return None
+    return pstats.Stats(os.path.join(profile_dir(), name))
+
+def func_name(func):
+    filename, line, name = func
+    return f'{name} ({os.path.basename(filename)}:{line})' if line else name
+
+def hotspots(stats, limit=200):
+    rows = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({
+                'function': func_name(func),
+                'file': func[0],
+                'calls': nc,
+                'primitive_calls': cc,
+                'total_ms': round(tt * 1000, 3),
+                'cumulative_ms': round(ct * 1000, 3),
+            })
+    return sorted(rows, key=lambda r: r['total_ms'], reverse=True)[0:limit]
+
+def flame_graph(stats, max_depth=40, min_ms=0.1):
+    """
+    d3-flame-graph style tree ({name, value, children}) built from cProfile's
+    caller graph. cProfile keeps caller/callee edges rather than full stacks,
+    so each child's value is that edge's cumulative time: a good approximation
+    unless a function is reached through several very different paths.
+    """
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, data in stats.stats.items() if not data[4]]
+
+    def node(func, value, path, depth):
+        children = []
+        if depth < max_depth:
+            for callee, ct in sorted(callees.get(func, []), key=lambda c: c[1], reverse=True):
+                if callee not in path and ct * 1000 >= min_ms:
+                    children.append(node(callee, ct, path | {callee}, depth + 1))
+        return {'name': func_name(func), 'value': round(value * 1000, 3), 'children': children}
+
+    return {'name': 'request', 'value': round(sum(stats.stats[r][3] for r in roots) * 1000, 3),
+            'children': [node(r, stats.stats[r][3], {r}, 1) for r in roots]}
+
+def init_app(app):
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
@@ -0,0 +1,182 @@
+"""
+Rendering helpers shared by the public and admin views.
+
+Markdown bodies can be rendered one top-level block at a time. split_blocks()
+only cuts where python-markdown would start a new top-level element anyway,
+so the rendered blocks joined with newlines are the same HTML as rendering
+the whole body at once. That lets render_markdown() cache each block by a
+hash of its source: after a one-paragraph edit to a long chapter only that
+paragraph goes through markdown again.
+
+The markdown engine itself is chosen by MARKDOWN_BACKEND: python-markdown
+(the default, and the only one installed with the site), markdown-it (the
+markdown-it-py package) or mistune. Block splitting follows python-markdown's
+rules, so the other backends render and cache each text whole. Run
+"python -m benchmarks backends" to see how they differ on the corpus before
+switching.
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import current_app
+from markdown import Markdown
+from markdown.util import BLOCK_LEVEL_ELEMENTS
+from app.perf import instrument
+from app.metrics import cache_hit, cache_miss
+
+TAB_LENGTH = 4
+BLANK_LINE = re.compile(r'(?<=\n) +\n')
+LIST_ITEM = re.compile(r' {0,3}(?:[*+-]|\d+\.)[ ]+')
+LEFT_TAG = re.compile(r'<([^> ]+)')
+## Reference definitions apply to the whole document, so a body with any can't be split
+REFERENCE = re.compile(r'^ {0,3}\[[^\]]+\]:', re.MULTILINE)
+local = threading.local()
+
+
+def python_markdown():
+    def convert(text):
+        # A per-thread instance; building one costs more than most blocks
+        if not hasattr(local, 'md'):
+            local.md = Markdown()
+        return local.md.reset().convert(text)
+    return convert
+
+def markdown_it():
+    from markdown_it import MarkdownIt
+    md = MarkdownIt('commonmark')
+    return lambda text: md.render(text).rstrip('\n')
+
+def mistune_markdown():
+    import mistune
+    md = mistune.create_markdown(escape=False)
+    return lambda text: md(text).rstrip('\n')
+
+BACKENDS = {
+        'python-markdown': python_markdown,
+        'markdown-it': markdown_it,
+        'mistune': mistune_markdown,
+    }
+
+
+class Renderer(object):
+    """The configured markdown backend."""
+
+    def __init__(self):
+        self.use('python-markdown')
+
+    def use(self, name):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown MARKDOWN_BACKEND {name!r}; use one of {', '.join(BACKENDS)}")
+        self.name = name
+        self.convert = instrument('markdown_ms')(BACKENDS[name]())
+        self.split = name == 'python-markdown'
+        block_cache.clear()
+
+def markdown(text):
+    return renderer.convert(text)
+
+
+class BlockCache(object):
+    """LRU of rendered markdown blocks, keyed by a hash of the block's source."""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def render(self, block):
+        key = hashlib.sha1(block.encode('utf-8')).digest()
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+        if html is not None:
+            cache_hit('markdown_block')
+            return html
+        cache_miss('markdown_block')
+        html = markdown(block)
+        with self.lock:
+            self.entries[key] = html
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+block_cache = BlockCache()
+renderer = Renderer()
+
+
+def stream_template(template_name, **context):
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(5)
+    return stream
+
+def normalize(text):
+    """The whitespace clean-up python-markdown does before it splits on blank lines."""
+    text = text.replace('\r\n', '\n').replace('\r', '\n').expandtabs(TAB_LENGTH)
+    return BLANK_LINE.sub('\n', text).strip('\n')
+
+def raw_html(chunk):
+    """
+    Whether python-markdown would lift the chunk out as a raw HTML block.
+    Those can run on across blank lines, so a body with any isn't split.
+    """
+    for i in range(2):
+        if chunk.startswith('\n'):
+            chunk = chunk[1:]
+    match = LEFT_TAG.match(chunk)
+    if not match or len(chunk.strip()) < 2:
+        return False
+    return chunk[1] in '!?@%' or match.group(1).lower().rstrip('/') in BLOCK_LEVEL_ELEMENTS
+
+def split_blocks(text):
+    """
+    Returns the top-level blocks of `text`. Chunks between blank lines are
+    joined back together where python-markdown would carry an element across
+    them: indented continuations, extra blank lines, and list items or quotes
+    following their own kind.
+    """
+    text = normalize(text)
+    chunks = text.split('\n\n')
+    if REFERENCE.search(text) or any(raw_html(chunk) for chunk in chunks):
+        return [text] if text else []
+    blocks = []
+    kind = None
+    for chunk in chunks:
+        start = chunk.lstrip('\n')
+        if LIST_ITEM.match(start):
+            chunk_kind = 'list'
+        elif start.startswith('>'):
+            chunk_kind = 'quote'
+        else:
+            chunk_kind = None
+        if blocks and (not chunk or chunk.startswith((' ', '\n')) or (chunk_kind and chunk_kind == kind)):
+            blocks[-1] += '\n\n' + chunk
+            kind = chunk_kind or kind
+        else:
+            blocks.append(chunk)
+            kind = chunk_kind
+    return blocks
+
+def render_blocks(text, render=block_cache.render):
+    """Yields the HTML of each block of `text`, with the newline that joins it to the one before."""
+    first = True
+    for block in split_blocks(text) if renderer.split else [text]:
+        html = render(block)
+        if html:
+            yield html if first else '\n' + html
+            first = False
+
+def render_markdown(text):
+    """markdown(text), re-rendering only the blocks that aren't cached."""
+    return ''.join(render_blocks(text))
+
+def init_app(app):
+    block_cache.size = app.config['MARKDOWN_BLOCK_CACHE_SIZE']
+    renderer.use(app.config['MARKDOWN_BACKEND'])
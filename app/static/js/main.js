@@ -48,6 +48,13 @@ $(document).ready(function() {
 	});
 	
 	$("blockquote").addClass("blockquote");
+
+	$('.theme-toggle').click(function(e) {
+		e.preventDefault();
+		var dark = !$('html').hasClass('theme-dark');
+		$('html').toggleClass('theme-dark', dark);
+		localStorage.setItem('theme', dark ? 'dark' : 'light');
+	});
 	
 	$('.page-toggle').click(function(e) {
 		e.stopPropigation;
@@ -186,6 +193,55 @@ $(document).ready(function() {
 		"lengthMenu": [[10, 25, 50, -1], [10, 25, 50, "All"]]
 	});
 
+	$('.datatable-server').each(function() {
+		var $table = $(this);
+		var cursors = {};
+		var pending = null;
+		$table.DataTable({
+			"lengthMenu": [[10, 25, 50, 100], [10, 25, 50, 100]],
+			"serverSide": true,
+			"processing": true,
+			"columns": $table.find('thead th').map(function(i) {
+				return {"data": String(i)};
+			}).get(),
+			"ajax": {
+				"url": $table.data('source'),
+				"data": function(d) {
+					var key = JSON.stringify([d.order, d.search.value, d.length]);
+					pending = {"key": key, "next": d.start + d.length};
+					var cursor = cursors[key + '|' + d.start];
+					if (d.start && cursor) {
+						d.after = cursor[0];
+						d.after_id = cursor[1];
+						if (cursor[2]) {
+							d.after_null = 1;
+						}
+					}
+				},
+				"dataSrc": function(json) {
+					if (pending && json.cursor) {
+						cursors[pending.key + '|' + pending.next] = json.cursor;
+					}
+					return json.data;
+				}
+			},
+			"drawCallback": function() {
+				$table.find('[data-toggle="tooltip"]').tooltip();
+				$table.find('.from-now').each(function() {
+					$(this).text(moment($(this).data('timestamp')).fromNow());
+				});
+			}
+		});
+	});
+
+	if ($('#logViewer').length) {
+		logViewer($('#logViewer'));
+	}
+
+	if ($('#flameGraph').length) {
+		flameGraph($('#flameGraph'));
+	}
+
 	$('.datatable-desc').DataTable({
 		"lengthMenu": [[10, 25, 50, -1], [10, 25, 50, "All"]],
 		"order": [[ 0, "desc"]]
@@ -279,3 +335,99 @@ function readProgress() {
 		});
 	}
 }
+
+function flameGraph($graph) {
+	// Icicle chart: each bar's width is its share of the root's time
+	$.getJSON($graph.data('source'), function(root) {
+		var total = root.value || 1;
+		function draw(node, $parent) {
+			var width = Math.max(node.value / total * 100, 0);
+			if (width < 0.2) {
+				return;
+			}
+			var $node = $('<div class="flame-node"></div>').css({
+				'display': 'inline-block', 'vertical-align': 'top', 'width': width + '%'
+			});
+			$('<div class="text-truncate small border bg-warning px-1"></div>')
+				.text(node.name)
+				.attr('title', node.name + ' (' + node.value + ' ms)')
+				.appendTo($node);
+			var $children = $('<div style="white-space: nowrap;"></div>').appendTo($node);
+			var scale = total;
+			total = node.value || 1;
+			$.each(node.children, function(i, child) {
+				draw(child, $children);
+			});
+			total = scale;
+			$node.appendTo($parent);
+		}
+		draw(root, $graph);
+	});
+}
+
+function logViewer($viewer) {
+	var $body = $viewer.find('tbody');
+	var before = null;
+	var source = null;
+
+	function row(record) {
+		var level = record.level || '';
+		var $tr = $('<tr>').toggleClass('table-danger', level == 'ERROR' || level == 'CRITICAL')
+			.toggleClass('table-warning', level == 'WARNING');
+		$tr.append($('<td>').append($('<small>').text(record.time || '')));
+		$tr.append($('<td>').text(level));
+		$tr.append($('<td>').append($('<small>').text(record.location || '')));
+		$tr.append($('<td>').append($('<pre class="mb-0">').text(record.message || '')));
+		return $tr;
+	}
+
+	function older() {
+		var params = before === null ? {} : {before: before};
+		$.getJSON($viewer.data('tail'), params, function(data) {
+			$.each(data.records, function(i, record) {
+				$body.append(row(record));
+			});
+			before = data.before;
+			$('#logOlder').toggle(before !== null);
+		});
+	}
+
+	function latest() {
+		$body.empty();
+		before = null;
+		older();
+	}
+
+	$('#logOlder').click(older);
+	$('#logClear').click(latest);
+
+	$('#logSearch').submit(function(e) {
+		e.preventDefault();
+		$body.empty();
+		$('#logOlder').hide();
+		var seen = 0;
+		var xhr = new XMLHttpRequest();
+		xhr.open('GET', $viewer.data('search') + '?' + $(this).serialize());
+		xhr.onprogress = function() {
+			var lines = xhr.responseText.split('\n');
+			for (; seen < lines.length - 1; seen++) {
+				$body.append(row(JSON.parse(lines[seen])));
+			}
+		};
+		xhr.send();
+	});
+
+	$('#logFollow').change(function() {
+		if (this.checked) {
+			source = new EventSource($viewer.data('stream'));
+			source.onmessage = function(e) {
+				$body.prepend(row(JSON.parse(e.data)));
+			};
+		} else if (source) {
+			source.close();
+			source = null;
+		}
+	});
+
+	latest();
+}
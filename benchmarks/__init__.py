@@ -0,0 +1,53 @@
+"""
+Benchmarks against a deterministic synthetic site.
+
+    python -m benchmarks build                  # benchmarks/data/corpus-s1.db
+    python -m benchmarks run --out before.json
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks mail --subscribers 5000
+    python -m benchmarks replay access.log --speed 10 --concurrency 16
+    python -m benchmarks markdown               # block rendering == markdown()
+    python -m benchmarks backends --backend markdown-it
+    python -m benchmarks ttfb                   # first byte of a long chapter, streamed or not
+    python -m benchmarks queries                # listings run constant queries
+
+The same seed and scale always build the same corpus, so two runs on the
+same machine are comparable.
+"""
+import os
+
+## Config reads these at import time; the benchmarks never send real mail
+os.environ.setdefault('MAIL_USERNAME', 'bench@example.com')
+os.environ.setdefault('MAIL_PASSWORD', 'bench')
+
+from config import Config
+from app import create_app
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+
+
+class BenchConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    MAIL_SUPPRESS_SEND = True
+    DATA_DIR = DATA_DIR
+    LOG_DIR = os.path.join(DATA_DIR, 'logs')
+    INVALIDATION_FILE = os.path.join(DATA_DIR, 'invalidation.gen')
+    QUERY_TRACKING = False
+    SLOW_QUERY_LOG = False
+    METRICS_ENABLED = False
+
+
+def corpus_path(scale):
+    return os.path.join(DATA_DIR, f'corpus-s{scale}.db')
+
+def bench_app(database, **config):
+    settings = dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///' + database)
+    return create_app(type('RunConfig', (BenchConfig,), settings))
+
+def login(client, user_id=1):
+    """Logs the test client in the way Flask-Login 0.4 reads the session."""
+    with client.session_transaction() as session:
+        session['user_id'] = str(user_id)
+        session['_fresh'] = True
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import click
+from benchmarks import DATA_DIR, bench_app, corpus_path
+from benchmarks import corpus, mail as mail_bench, queries as query_check, rendering, replay as replayer, run as runner
+
+
+@click.group()
+def cli():
+    """Synthetic-site benchmarks."""
+
+@cli.command()
+@click.option('--seed', type=int, default=1)
+@click.option('--scale', type=int, default=1, help='Multiplies stories, posts, tags and products.')
+@click.option('--subscribers', type=int, default=100000)
+@click.option('--years', type=int, default=5, help='Years of writing records.')
+def build(seed, scale, subscribers, years):
+    """Build the corpus database for a scale, replacing any existing one."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    database = corpus_path(scale)
+    if os.path.exists(database):
+        os.remove(database)
+    app = bench_app(database)
+    with app.app_context():
+        manifest = corpus.build(seed, scale, subscribers, years)
+    corpus.save_manifest(manifest, database[:-3] + '.json')
+    click.echo(f"Built {database}: {json.dumps(manifest['counts'])}")
+
+@cli.command()
+@click.option('--scale', type=int, default=1)
+@click.option('--iterations', type=int, default=50, help='Timed requests per scenario.')
+@click.option('--warmup', type=int, default=5)
+@click.option('--only', multiple=True, type=click.Choice(list(runner.SCENARIOS)), help='Repeatable.')
+@click.option('--out', type=click.Path(dir_okay=False), help='Write the JSON results here.')
+def run(scale, iterations, warmup, only, out):
+    """Time every scenario against a built corpus."""
+    database = corpus_path(scale)
+    if not os.path.exists(database):
+        raise click.ClickException(f'No corpus at {database}; run "python -m benchmarks build --scale {scale}".')
+    results = runner.run(bench_app(database), corpus.load_manifest(database[:-3] + '.json'),
+            iterations, warmup, only, echo=click.echo)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f'Results written to {out}')
+    else:
+        click.echo(json.dumps(results, indent=2))
+
+@cli.command()
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+@click.option('--threshold', type=float, default=10.0, help='Allowed p90 slowdown in percent.')
+def compare(before, after, threshold):
+    """Compare two result files; exits 1 when a scenario regressed."""
+    regressions = runner.compare(json.load(before), json.load(after), threshold, echo=click.echo)
+    if regressions:
+        click.echo(f"{len(regressions)} regression(s): {', '.join(regressions)}", err=True)
+        sys.exit(1)
+
+@cli.command()
+@click.option('--subscribers', type=int, default=1000)
+@click.option('--timeout', type=int, default=300, help='Seconds to wait for each blast to drain.')
+@click.option('--out', type=click.Path(dir_okay=False), help='Write the JSON results here.')
+def mail(subscribers, timeout, out):
+    """Send a new-chapter notification and an admin email to every subscriber through a local SMTP sink."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    results = mail_bench.run(bench_app(os.path.join(DATA_DIR, 'mail.db')), subscribers, timeout)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    click.echo(json.dumps(results, indent=2))
+
+@cli.command()
+@click.argument('log', type=click.Path(exists=True, dir_okay=False))
+@click.option('--url', help='Replay against a running server (e.g. http://127.0.0.1:5000) instead of in-process.')
+@click.option('--database', type=click.Path(dir_okay=False), help='SQLite database for in-process replay; '
+        'defaults to the scale 1 corpus.')
+@click.option('--speed', type=float, default=0, help='Speed-up over the logged timing; 0 sends as fast as possible.')
+@click.option('--concurrency', type=int, default=8)
+@click.option('--all-paths', is_flag=True, help='Include static, uploads and admin requests.')
+@click.option('--ramp', 'p99_target', type=float, help='Double concurrency until p99 exceeds this many ms.')
+@click.option('--stage-requests', type=int, default=500, help='Requests per ramp stage.')
+@click.option('--out', type=click.Path(dir_okay=False), help='Write the JSON results here.')
+def replay(log, url, database, speed, concurrency, all_paths, p99_target, stage_requests, out):
+    """Replay an access log (combined format) or a file of paths."""
+    requests = replayer.read_requests(log, all_paths)
+    if not requests:
+        raise click.ClickException(f'No replayable requests in {log}.')
+    target = replayer.Target(bench_app(database or corpus_path(1)), url)
+    if p99_target:
+        results = replayer.ramp(target, requests, p99_target, stage_requests=stage_requests, echo=click.echo)
+    else:
+        results = replayer.replay(target, requests, concurrency, speed)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    click.echo(json.dumps(results, indent=2))
+
+@cli.command('markdown')
+@click.option('--scale', type=int, default=1)
+@click.option('--out', type=click.Path(dir_okay=False), help='Write the JSON results here.')
+def markdown_blocks(scale, out):
+    """Check block-rendered markdown against markdown() over the corpus and time a one-paragraph edit."""
+    database = corpus_path(scale)
+    if not os.path.exists(database):
+        raise click.ClickException(f'No corpus at {database}; run "python -m benchmarks build --scale {scale}".')
+    with bench_app(database).app_context():
+        results = {'check': rendering.check(echo=click.echo), 'edit': rendering.edit()}
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    click.echo(json.dumps(results, indent=2))
+    if results['check']['mismatches'] or not results['edit']['identical']:
+        sys.exit(1)
+
+@cli.command()
+@click.option('--scale', type=int, default=1)
+@click.option('--rounds', type=int, default=5, help='Cold requests per mode; the best counts.')
+def ttfb(scale, rounds):
+    """Time the first byte and the whole body of the longest chapter, streamed and not."""
+    database = corpus_path(scale)
+    if not os.path.exists(database):
+        raise click.ClickException(f'No corpus at {database}; run "python -m benchmarks build --scale {scale}".')
+    click.echo(json.dumps(rendering.first_byte(bench_app(database), rounds), indent=2))
+
+@cli.command()
+@click.option('--scale', type=int, default=1)
+@click.option('--backend', 'backends', multiple=True, type=click.Choice(list(rendering.BACKENDS)),
+        help='Repeatable; defaults to every backend.')
+@click.option('--rounds', type=int, default=3, help='Timed passes over the pages; the best counts.')
+@click.option('--samples', type=int, default=5, help='Differences to show per backend.')
+@click.option('--out', type=click.Path(dir_okay=False), help='Write the JSON results here.')
+def backends(scale, backends, rounds, samples, out):
+    """Compare each markdown backend's HTML with python-markdown's over the corpus and time them."""
+    database = corpus_path(scale)
+    if not os.path.exists(database):
+        raise click.ClickException(f'No corpus at {database}; run "python -m benchmarks build --scale {scale}".')
+    backends = backends or list(rendering.BACKENDS)
+    with bench_app(database).app_context():
+        results = {
+                'compatibility': rendering.compare(backends, samples, echo=click.echo),
+                'throughput': rendering.throughput(backends, rounds),
+            }
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    click.echo(json.dumps(results, indent=2))
+
+@cli.command()
+@click.option('--scale', type=int, default=1)
+def queries(scale):
+    """Check that story pages and feeds run a constant number of queries; exits 1 if not."""
+    database = corpus_path(scale)
+    if not os.path.exists(database):
+        raise click.ClickException(f'No corpus at {database}; run "python -m benchmarks build --scale {scale}".')
+    results = query_check.scaling(bench_app(database), corpus.load_manifest(database[:-3] + '.json'),
+            echo=click.echo)
+    if not all(result['constant'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,211 @@
+import json
+import random
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, Page, Tag, Subscriber, Definition, Link, Product, Record, tags as page_tags
+
+## Every date is relative to this so the corpus never depends on when it was built
+ANCHOR = datetime(2020, 1, 31, 12, 0, 0)
+BATCH = 5000
+
+WORDS = '''the of and to a in was he she it that his her had with for as on at you not they
+but said from all were one what there have this by be so out up like into then them could no
+when would more about over back only him down before through now any than just old little
+light dark wind river stone forest road village mountain voice hand heart morning night fire
+water shadow sprig leaf root branch door window silence storm memory letter promise city
+walked turned looked whispered remembered carried waited listened ran followed reached held
+quiet bright cold broken gentle strange ancient hollow golden tired hidden small long green'''.split()
+SYLLABLES = ['ar', 'bel', 'cor', 'dan', 'el', 'fen', 'gar', 'hal', 'is', 'jor', 'kel', 'lin',
+        'mor', 'nor', 'ost', 'pel', 'quin', 'ros', 'sil', 'tor', 'ul', 'ven', 'wyn', 'yth', 'zar']
+FIRST_NAMES = ['James', 'Mary', 'John', 'Linda', 'Robert', 'Emma', 'David', 'Sofia', 'Daniel',
+        'Grace', 'Samuel', 'Olivia', 'Henry', 'Ava', 'Lucas', 'Mia', 'Owen', 'Chloe', None]
+LAST_NAMES = ['Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Lopez', 'Wilson',
+        'Clark', 'Lewis', 'Walker', 'Hall', 'Young', 'King', 'Wright', None]
+SUBSCRIPTIONS = [',news,sprig,blog,', ',sprig,', ',blog,', ',news,', ',sprig,blog,']
+
+
+class Writer(object):
+    """Deterministic markdown with the features the page filters care about."""
+
+    def __init__(self, rnd):
+        self.rnd = rnd
+
+    def name(self, syllables=2):
+        return ''.join(self.rnd.choice(SYLLABLES) for i in range(syllables)).title()
+
+    def title(self, words=3):
+        return ' '.join(self.rnd.choice(WORDS) for i in range(words)).title()
+
+    def sentence(self):
+        words = [self.rnd.choice(WORDS) for i in range(self.rnd.randint(6, 22))]
+        roll = self.rnd.random()
+        if roll < 0.1:
+            i = self.rnd.randrange(len(words))
+            words[i] = f'*{words[i]}*'
+        elif roll < 0.15:
+            i = self.rnd.randrange(len(words))
+            words[i] = f'**{words[i]}**'
+        elif roll < 0.25:
+            words.insert(self.rnd.randrange(1, len(words)), '--')
+        text = ' '.join(words)
+        if self.rnd.random() < 0.2:
+            return f'"{text[0].upper()}{text[1:]}," {self.name()} said.'
+        return f'{text[0].upper()}{text[1:]}.'
+
+    def paragraph(self):
+        return ' '.join(self.sentence() for i in range(self.rnd.randint(2, 7)))
+
+    def body(self, words, products=0):
+        blocks = []
+        count = 0
+        while count < words:
+            roll = self.rnd.random()
+            if roll < 0.03:
+                blocks.append('---')
+            elif roll < 0.05:
+                blocks.append(f'## {self.title()}')
+            elif roll < 0.07:
+                blocks.append('\n'.join(f'- {self.sentence()}' for i in range(self.rnd.randint(2, 5))))
+            elif roll < 0.08:
+                blocks.append(f'> {self.paragraph()}')
+            elif roll < 0.09 and products:
+                blocks.append(f'p[{self.rnd.randint(1, products)}|]')
+            else:
+                blocks.append(self.paragraph())
+            count += len(blocks[-1].split())
+        return '\n\n'.join(blocks)
+
+
+def insert(table, rows):
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[i:i + BATCH])
+
+def page_row(page_id, title, slug, template, body, sort, pub_date, parent=None, published=True, summary=None):
+    path = f"{parent['path']}/{slug}" if parent else f'/{slug}'
+    return {
+            'id': page_id, 'title': title, 'slug': slug, 'path': path,
+            'dir_path': parent['path'] if parent else '/', 'parent_id': parent['id'] if parent else None,
+            'template': template, 'body': body, 'notes': '', 'summary': summary, 'sidebar': '',
+            'User': 1, 'sort': sort, 'pub_date': pub_date, 'published': published,
+            'edit_date': pub_date or ANCHOR,
+        }
+
+def build(seed=1, scale=1, subscribers=100000, years=5):
+    """
+    Fills an empty database and returns a manifest of the paths and names
+    the benchmark scenarios request. Roughly, per unit of scale: 40 stories
+    with 10-90 chapters each, 300 blog posts, 800 definitions and 30 products.
+    """
+    rnd = random.Random(seed)
+    writer = Writer(rnd)
+    db.drop_all()
+    db.create_all()
+
+    admin = User(id=1, username='admin', email='admin@example.com')
+    admin.set_password('bench')
+    db.session.add(admin)
+
+    products = 30 * scale
+    insert(Product.__table__, [{
+            'id': i, 'name': writer.title(2), 'price': f'${rnd.randint(5, 40)}.99',
+            'description': writer.sentence(), 'image': '/uploads/missing-product.png',
+            'sort': rnd.randint(1, 500), 'active': rnd.random() < 0.8,
+        } for i in range(1, products + 1)])
+    insert(Link.__table__, [{
+            'product_id': i, 'text': text, 'url': f'https://example.com/{i}/{text.lower()}', 'sort': sort,
+        } for i in range(1, products + 1) for sort, text in enumerate(['Amazon', 'Etsy'])])
+
+    tag_names = sorted({writer.name(rnd.randint(1, 3)) for i in range(60 * scale)})
+    insert(Tag.__table__, [{'id': i, 'name': name} for i, name in enumerate(tag_names, 1)])
+
+    pages = []
+    def add(*args, **kwargs):
+        parent = kwargs.pop('parent', None)
+        pages.append(page_row(len(pages) + 1, *args, parent=parent, **kwargs))
+        return pages[-1]
+
+    start = ANCHOR - timedelta(days=365 * years)
+    add('Home', 'home', 'page', writer.body(300), 0, start)
+    for slug in ['search', 'shop', '404-error', 'admin', 'subscriber-welcome']:
+        add(slug.replace('-', ' ').title(), slug, 'page', writer.body(80), 900, start)
+    stories = add('Stories', 'stories', 'page', writer.body(150), 10, start)
+    blog = add('Blog', 'blog', 'blog', writer.body(150), 20, start)
+
+    story_pages = []
+    for s in range(40 * scale):
+        pub_date = start + timedelta(days=rnd.randint(0, 365 * years - 200))
+        story = add(writer.title(2), f'story-{s}', 'story', writer.body(rnd.randint(100, 400)),
+                rnd.randint(1, 100), pub_date, parent=stories, summary=writer.sentence()[0:300])
+        story_pages.append(story)
+        for c in range(rnd.randint(10, 90)):
+            pub_date += timedelta(days=rnd.randint(2, 14))
+            add(f'Chapter {c + 1}: {writer.title()}', f'chapter-{c + 1}', 'chapter',
+                    writer.body(rnd.randint(1500, 4500), products), c + 1, min(pub_date, ANCHOR),
+                    parent=story, published=rnd.random() < 0.95)
+    for p in range(300 * scale):
+        add(writer.title(4), f'post-{p}', 'post', writer.body(rnd.randint(400, 1500), products), 75,
+                start + timedelta(hours=rnd.randint(0, 365 * years * 24)), parent=blog,
+                published=rnd.random() < 0.9)
+    insert(Page.__table__, pages)
+    insert(page_tags, [{'page_id': page['id'], 'tag_id': tag_id} for page in pages
+            for tag_id in rnd.sample(range(1, len(tag_names) + 1), rnd.randint(0, 4))])
+
+    insert(Definition.__table__, [{
+            'name': writer.name(rnd.randint(2, 3)), 'body': writer.body(rnd.randint(20, 150)),
+            'hidden_body': writer.paragraph() if rnd.random() < 0.3 else None,
+            'type': rnd.choice(Definition.TYPE_CHOICES)[0], 'parent_id': story['id'],
+            'tag_id': rnd.randint(1, len(tag_names)) if rnd.random() < 0.5 else None, 'active': True,
+        } for story in story_pages for i in range(20)])
+
+    rows = []
+    for i in range(subscribers):
+        first, last = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+        rows.append({
+                'email': f'{(first or "reader").lower()}.{i}@example.com', 'first_name': first,
+                'last_name': last, 'subscription': rnd.choice(SUBSCRIPTIONS),
+                'sub_date': start + timedelta(minutes=rnd.randint(0, 365 * years * 24 * 60)),
+            })
+    insert(Subscriber.__table__, rows)
+
+    rows = []
+    day = start.date()
+    while day <= ANCHOR.date():
+        overall = 0
+        for session in range(rnd.choice([0, 1, 1, 2, 3, 4])):
+            start_words = rnd.randint(0, 3000)
+            words = rnd.randint(100, 2500)
+            minutes = rnd.randint(15, 180)
+            overall += words
+            rows.append({
+                    'words': words, 'start_words': start_words, 'end_words': start_words + words,
+                    'overall_words': overall, 'comment': writer.title(3) if rnd.random() < 0.3 else None,
+                    'minutes': minutes, 'words_per_minute': int(words / minutes), 'date': day,
+                    'created': datetime.combine(day, datetime.min.time()) + timedelta(hours=8 + session * 3),
+                })
+        day += timedelta(days=1)
+    insert(Record.__table__, rows)
+    db.session.commit()
+
+    published = [p for p in pages if p['published']]
+    chapters = [p for p in published if p['template'] == 'chapter']
+    posts = [p for p in published if p['template'] == 'post']
+    return {
+            'seed': seed,
+            'scale': scale,
+            'counts': {'pages': len(pages), 'chapters': len(chapters), 'posts': len(posts),
+                    'subscribers': subscribers, 'records': len(rows), 'tags': len(tag_names)},
+            'stories': [s['path'] for s in rnd.sample(story_pages, min(10, len(story_pages)))],
+            'chapters': [c['path'] for c in rnd.sample(chapters, min(20, len(chapters)))],
+            'posts': [p['path'] for p in rnd.sample(posts, min(20, len(posts)))],
+            'tags': rnd.sample(tag_names, min(5, len(tag_names))),
+            'keywords': ['sprig', 'hollow', 'whispered'],
+            'records_day': ANCHOR.strftime('%Y%m%d'),
+        }
+
+def save_manifest(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
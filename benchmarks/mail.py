@@ -0,0 +1,183 @@
+"""
+Notification blast throughput against a local SMTP sink.
+
+The sink speaks just enough SMTP for smtplib, counts connections and
+messages and throws the mail away, so the numbers measure app/email.py
+rather than a mail provider.
+"""
+import os
+import time
+import random
+import resource
+import threading
+import socketserver
+from app import db
+from app.models import User, Page, Subscriber
+from benchmarks.corpus import ANCHOR, SUBSCRIPTIONS, Writer, insert, page_row
+from benchmarks import login
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.count('connections')
+        self.reply('220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line[0:4].upper()
+            if command == b'EHLO':
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command == b'RCPT':
+                self.server.count('recipients')
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                self.server.count('messages')
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {'connections': 0, 'recipients': 0, 'messages': 0}
+        self.last_message = None
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+            if key == 'messages':
+                self.last_message = time.perf_counter()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Monitor(object):
+    """Samples thread count and RSS in the background while a blast runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.peak_rss_kb = rss_kb()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while self.running:
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_kb = max(self.peak_rss_kb, rss_kb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        return False
+
+
+def seed(subscribers, seed=1):
+    rnd = random.Random(seed)
+    writer = Writer(rnd)
+    db.drop_all()
+    db.create_all()
+    admin = User(id=1, username='admin', email='admin@example.com')
+    admin.set_password('bench')
+    db.session.add(admin)
+    story = page_row(1, 'Sprig', 'sprig', 'story', writer.body(200), 1, ANCHOR)
+    insert(Page.__table__, [story, page_row(2, 'Chapter 1: ' + writer.title(), 'chapter-1', 'chapter',
+            writer.body(3000), 1, ANCHOR, parent=story)])
+    insert(Subscriber.__table__, [{
+            'email': f'reader.{i}@example.com', 'first_name': f'Reader{i}', 'last_name': None,
+            'subscription': rnd.choice(SUBSCRIPTIONS), 'sub_date': ANCHOR,
+        } for i in range(subscribers)])
+    db.session.commit()
+
+def blast(sink, expected, trigger, timeout):
+    sink.reset()
+    baseline_threads = threading.active_count()
+    with Monitor() as monitor:
+        start = time.perf_counter()
+        trigger()
+        returned = time.perf_counter()
+        while sink.counts['messages'] < expected and time.perf_counter() - start < timeout:
+            time.sleep(0.01)
+        finished = sink.last_message or time.perf_counter()
+    elapsed = finished - start
+    return {
+            'expected': expected,
+            'delivered': sink.counts['messages'],
+            'smtp_connections': sink.counts['connections'],
+            'smtp_recipients': sink.counts['recipients'],
+            'request_s': round(returned - start, 3),
+            'completion_s': round(elapsed, 3),
+            'messages_per_s': round(sink.counts['messages'] / elapsed, 1) if elapsed else None,
+            'peak_threads': monitor.peak_threads,
+            'extra_threads': monitor.peak_threads - baseline_threads,
+            'peak_rss_kb': monitor.peak_rss_kb,
+            'timed_out': sink.counts['messages'] < expected,
+        }
+
+def run(app, subscribers, timeout=300):
+    """Seeds `subscribers` readers, then times notify_subscribers() and the admin send_mail form."""
+    sink = SMTPSink().start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=sink.port, MAIL_USE_SSL=False,
+            MAIL_USE_TLS=False, MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_SUPPRESS_SEND=False)
+    ## Flask-Mail copies its settings when init_app runs
+    from app import mail
+    mail.init_app(app)
+    results = {'subscribers': subscribers}
+    with app.app_context():
+        seed(subscribers)
+        ids = [s.id for s in Subscriber.query.with_entities(Subscriber.id)]
+
+    def notify():
+        with app.test_request_context():
+            Page.query.get(2).notify_subscribers('all')
+    results['notify_subscribers'] = blast(sink, subscribers, notify, timeout)
+
+    client = app.test_client()
+    login(client)
+    def send_mail():
+        response = client.post('/admin/subscriber/email', data={'subject': 'Benchmark',
+                'recipients': ids, 'banner': '', 'body': Writer(random.Random(1)).body(300)})
+        assert response.status_code == 200, response.status_code
+    results['send_mail'] = blast(sink, subscribers, send_mail, timeout)
+    sink.shutdown()
+    return results
@@ -0,0 +1,49 @@
+"""
+Checks that listing pages cost the same number of queries however many
+children they list.
+
+Every story page (chapter list and table of contents) and its RSS feed is
+requested once with a QueryTracker, next to the number of published children
+the story has. Within a kind of page the count should be flat; one that
+grows with the children is an N+1 query, and the statements behind it are
+reported.
+"""
+from app.models import Page
+from app.perf import QueryTracker
+
+## name: story path -> url
+LISTINGS = {
+        'story': lambda path: path,
+        'rss_story': lambda path: f'/rss{path}',
+    }
+
+
+def children(path):
+    story = Page.query.filter_by(path=path).first()
+    return len(story.pub_children()) if story else 0
+
+def scaling(app, manifest, echo=print):
+    client = app.test_client()
+    with app.app_context():
+        counts = {path: children(path) for path in manifest['stories']}
+    results = {}
+    for name, url in LISTINGS.items():
+        ## the first request also builds the nav
+        client.get(url(manifest['stories'][0])).get_data()
+        seen = {}
+        for path in manifest['stories']:
+            with QueryTracker() as tracker:
+                response = client.get(url(path), follow_redirects=True)
+                response.get_data()
+            seen.setdefault(tracker.total, (counts[path], path, tracker))
+        queries = sorted(seen)
+        results[name] = {
+                'queries': queries,
+                'children': sorted({count for count, path, tracker in seen.values()}),
+                'constant': len(queries) == 1,
+            }
+        echo(f"{name:<12} {'constant' if len(queries) == 1 else 'VARIES':<9} queries {queries}")
+        if len(queries) > 1:
+            count, path, tracker = seen[queries[-1]]
+            echo(f'  {path} ({count} children):\n{tracker.report()}')
+    return results
@@ -0,0 +1,180 @@
+"""
+Checks and times block-level markdown rendering.
+
+check() renders every page body, sidebar and notes and every definition in
+the corpus twice: whole, through python-markdown, and a block at a time
+through app.render. Any text where the two differ by a byte is reported.
+edit() times the longest chapter cold, warm and after changing one
+paragraph. first_byte() requests that chapter with and without streaming and
+times the first byte, the end of the <head> (when a browser can start on the
+stylesheets) and the whole body, rendering from a cold block cache.
+
+compare() renders the same texts through each markdown backend and counts
+where the HTML differs from python-markdown's, both byte for byte and after
+normalizing whitespace and entities, with a few examples of each.
+throughput() reports pages per second for each backend on the page bodies.
+"""
+import re
+import html
+import time
+import random
+import difflib
+from markdown import markdown
+from app import db
+from app.models import Page, Definition
+from app.content import Content
+from app.render import BACKENDS, block_cache, render_markdown, split_blocks
+
+
+def prepare(text):
+    return Content(text).get('markdown')
+
+def sources():
+    """Yields (name, markdown) for every text the site renders."""
+    for page in Page.query.order_by(Page.id):
+        yield f'page:{page.id}', prepare(page.body)
+        if page.notes:
+            yield f'notes:{page.id}', prepare(page.notes)
+        if page.sidebar:
+            yield f'sidebar:{page.id}', page.sidebar
+    for definition in Definition.query.order_by(Definition.id):
+        yield f'definition:{definition.id}', prepare(definition.body)
+        if definition.hidden_body:
+            yield f'hidden:{definition.id}', prepare(definition.hidden_body)
+
+def check(echo=print):
+    block_cache.clear()
+    checked = 0
+    mismatches = []
+    for name, text in sources():
+        checked += 1
+        if render_markdown(text) != markdown(text):
+            mismatches.append(name)
+            echo(f'{name}: block output differs from markdown()')
+    return {'checked': checked, 'mismatches': mismatches}
+
+def timed(func, text):
+    start = time.perf_counter()
+    html = func(text)
+    return html, round((time.perf_counter() - start) * 1000, 3)
+
+def edit(seed=1):
+    """Times re-rendering the longest chapter after one of its paragraphs changes."""
+    page = Page.query.filter_by(template='chapter').order_by(db.func.length(Page.body).desc()).first()
+    text = prepare(page.body)
+    blocks = split_blocks(text)
+    i = random.Random(seed).randrange(len(blocks))
+    edited = '\n\n'.join(blocks[:i] + [blocks[i] + ' Edited.'] + blocks[i + 1:])
+
+    block_cache.clear()
+    whole, whole_ms = timed(markdown, text)
+    cold, cold_ms = timed(render_markdown, text)
+    warm, warm_ms = timed(render_markdown, text)
+    changed, edited_ms = timed(render_markdown, edited)
+    return {
+            'page': page.path,
+            'chars': len(text),
+            'blocks': len(blocks),
+            'whole_ms': whole_ms,
+            'cold_ms': cold_ms,
+            'warm_ms': warm_ms,
+            'edited_ms': edited_ms,
+            'identical': whole == cold == warm and changed == markdown(edited),
+        }
+
+def first_byte(app, rounds=5):
+    """Best of `rounds` cold requests for the longest chapter, streamed and whole, in ms."""
+    with app.app_context():
+        page = Page.query.filter_by(template='chapter', published=True).order_by(
+                db.func.length(Page.body).desc()).first()
+        path, chars = page.path, len(page.body)
+    client = app.test_client()
+    results = {'page': path, 'chars': chars}
+    for name, stream in [('streamed', True), ('whole', False)]:
+        app.config.update(STREAM_PAGES=stream, STREAM_MIN_CHARS=0)
+        times = {'first_byte_ms': [], 'head_ms': [], 'total_ms': []}
+        for i in range(rounds):
+            block_cache.clear()
+            start = time.perf_counter()
+            response = client.get(path, buffered=False)
+            first = head = None
+            for chunk in response.response:
+                elapsed = (time.perf_counter() - start) * 1000
+                first = first or elapsed
+                if head is None and b'</head>' in (chunk if isinstance(chunk, bytes) else chunk.encode()):
+                    head = elapsed
+            times['total_ms'].append((time.perf_counter() - start) * 1000)
+            times['first_byte_ms'].append(first)
+            times['head_ms'].append(head)
+            response.close()
+        results[name] = {metric: round(min(values), 3) for metric, values in times.items()}
+    return results
+
+def load(backends):
+    """{name: convert} for the backends that are installed, and the names of those that aren't."""
+    converters, missing = {}, []
+    for name in backends:
+        try:
+            converters[name] = BACKENDS[name]()
+        except ImportError:
+            missing.append(name)
+    return converters, missing
+
+WHITESPACE = re.compile(r'\s+')
+BETWEEN_TAGS = re.compile(r'>\s+<')
+
+def normalized(text):
+    return WHITESPACE.sub(' ', BETWEEN_TAGS.sub('><', html.unescape(text))).strip()
+
+def first_difference(expected, actual, context=60):
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op != 'equal':
+            start = max(i1 - context, 0)
+            return {'expected': expected[start:i2 + context], 'actual': actual[max(j1 - context, 0):j2 + context]}
+
+def compare(backends, samples=5, echo=print):
+    """Counts, per backend, the corpus texts whose HTML differs from python-markdown's."""
+    converters, missing = load(backends)
+    reference = BACKENDS['python-markdown']()
+    results = {name: {'unavailable': True} for name in missing}
+    totals = {name: {'checked': 0, 'identical': 0, 'equivalent': 0, 'examples': []} for name in converters}
+    for source, text in sources():
+        expected = reference(text)
+        for name, convert in converters.items():
+            total = totals[name]
+            total['checked'] += 1
+            actual = convert(text)
+            if actual == expected:
+                total['identical'] += 1
+            elif normalized(actual) == normalized(expected):
+                total['equivalent'] += 1
+            elif len(total['examples']) < samples:
+                total['examples'].append(dict(source=source, **first_difference(expected, actual)))
+    for name, total in totals.items():
+        total['different'] = total['checked'] - total['identical'] - total['equivalent']
+        echo(f"{name}: {total['identical']} identical, {total['equivalent']} equivalent, "
+                f"{total['different']} different of {total['checked']}")
+        results[name] = total
+    return results
+
+def throughput(backends, rounds=3):
+    """Pages per second for each backend rendering every page body whole, best of `rounds`."""
+    converters, missing = load(backends)
+    texts = [prepare(page.body) for page in Page.query.order_by(Page.id)]
+    chars = sum(len(text) for text in texts)
+    results = {name: {'unavailable': True} for name in missing}
+    for name, convert in converters.items():
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for text in texts:
+                convert(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {
+                'pages': len(texts),
+                'pages_per_sec': round(len(texts) / best, 1),
+                'mb_per_sec': round(chars / best / 1e6, 2),
+            }
+    return results
@@ -0,0 +1,157 @@
+"""
+Replays recorded traffic, from an access log or a list of paths, at a chosen
+speed-up and concurrency, either in-process through the test client or
+against a running server.
+"""
+import re
+import time
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from werkzeug.routing import RequestRedirect
+from benchmarks.run import percentile
+
+## nginx/Apache "combined" and "common" formats
+ACCESS_LINE = re.compile(r'^\S+ \S+ \S+ \[([^\]]+)\] "(GET|HEAD) (\S+)[^"]*" (\d{3}) ')
+SKIPPED_PREFIXES = ('/static/', '/uploads/', '/admin', '/metrics')
+
+
+def read_requests(path, include_all=False):
+    """
+    Returns [(seconds since the first request, path)]. Lines of a plain path
+    list have no timing, so they are spaced evenly one second apart.
+    """
+    requests = []
+    first = None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if line.startswith('/'):
+                offset, url = float(number), line
+            else:
+                match = ACCESS_LINE.match(line)
+                if not match:
+                    continue
+                stamp = datetime.strptime(match.group(1), '%d/%b/%Y:%H:%M:%S %z').timestamp()
+                first = stamp if first is None else first
+                offset, url = stamp - first, match.group(3)
+            if include_all or not url.startswith(SKIPPED_PREFIXES):
+                requests.append((offset, url))
+    return sorted(requests, key=lambda r: r[0])
+
+
+class Target(object):
+    """
+    Sends one GET and returns its status code, 0 for a connection error.
+    In-process, TESTING lets a view's exception reach the test client, so
+    one is counted as a 500 rather than lost with its worker's sample.
+    """
+
+    def __init__(self, app, base_url=None, timeout=30):
+        self.app = app
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.timeout = timeout
+        self.local = threading.local()
+        self.adapter = app.url_map.bind('localhost')
+
+    def route(self, url):
+        try:
+            return self.adapter.match(url.split('?')[0], method='GET')[0]
+        except RequestRedirect:
+            return 'redirect'
+        except (NotFound, MethodNotAllowed):
+            return 'not_found'
+
+    def get(self, url):
+        if self.base_url is None:
+            if not hasattr(self.local, 'client'):
+                self.local.client = self.app.test_client()
+            try:
+                response = self.local.client.get(url)
+                response.get_data()
+            except Exception:
+                self.app.logger.exception(f'replay: {url}')
+                return 500
+            return response.status_code
+        try:
+            with urllib.request.urlopen(self.base_url + url, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError):
+            return 0
+
+
+def replay(target, requests, concurrency=8, speed=0):
+    """
+    Plays `requests` against `target`. With a `speed` of 10 an hour of log
+    takes six minutes; 0 sends as fast as the workers allow.
+    Returns the per-route report.
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def send(url):
+        start = time.perf_counter()
+        status = target.get(url)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            samples[target.route(url)].append((elapsed, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, url in requests:
+            if speed:
+                delay = offset / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, url)
+    return report(samples, time.perf_counter() - start)
+
+def report(samples, wall):
+    routes = {}
+    everything = []
+    for route, results in sorted(samples.items()):
+        everything += results
+        routes[route] = summarize(results, wall)
+    return {'wall_s': round(wall, 3), 'total': summarize(everything, wall), 'routes': routes}
+
+def summarize(results, wall):
+    times = [elapsed for elapsed, status in results]
+    errors = sum(1 for elapsed, status in results if status >= 500 or status == 0)
+    return {
+            'count': len(results),
+            'rps': round(len(results) / wall, 2) if wall else None,
+            'p50': round(percentile(times, 50), 2),
+            'p90': round(percentile(times, 90), 2),
+            'p99': round(percentile(times, 99), 2),
+            'errors': errors,
+            'error_rate': round(errors / len(results), 4) if results else 0,
+        }
+
+def ramp(target, requests, p99_target, start=1, limit=256, stage_requests=500, echo=print):
+    """
+    Doubles concurrency each stage, sending `stage_requests` as fast as
+    possible, until overall p99 passes `p99_target` ms (or errors appear).
+    The last passing concurrency is the saturation point.
+    """
+    stages = []
+    concurrency = start
+    saturation = None
+    while concurrency <= limit:
+        batch = [requests[i % len(requests)] for i in range(stage_requests)]
+        result = replay(target, batch, concurrency)['total']
+        result['concurrency'] = concurrency
+        stages.append(result)
+        echo(f"concurrency {concurrency:>4}: {result['rps']:>8} req/s  p99 {result['p99']:>9.2f}ms  "
+                f"errors {result['errors']}")
+        if result['p99'] > p99_target or result['errors']:
+            break
+        saturation = result
+        concurrency *= 2
+    return {'p99_target': p99_target, 'saturation': saturation, 'stages': stages}
@@ -0,0 +1,136 @@
+import sys
+import math
+import time
+import platform
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime
+from app.perf import QueryTracker
+from benchmarks import login
+
+## name: (needs login, manifest -> list of urls)
+SCENARIOS = {
+        'home': (False, lambda m: ['/']),
+        'story': (False, lambda m: m['stories']),
+        'chapter': (False, lambda m: m['chapters']),
+        'blog': (False, lambda m: ['/blog']),
+        'post': (False, lambda m: m['posts']),
+        'search_tag': (False, lambda m: [f'/search/tag/{tag}' for tag in m['tags']]),
+        'search_keyword': (False, lambda m: [f'/search/keyword/{word}' for word in m['keywords']]),
+        'glossary': (False, lambda m: [f'{path}/glossary' for path in m['stories']]),
+        'rss_all': (False, lambda m: ['/rss/all']),
+        'rss_story': (False, lambda m: [f'/rss{path}' for path in m['stories']]),
+        'shop': (False, lambda m: ['/shop']),
+        'admin_pages': (True, lambda m: ['/admin/pages?draw=1&start=0&length=25',
+                '/admin/pages?draw=1&start=0&length=25&order[0][column]=4&order[0][dir]=desc']),
+        'admin_pages_search': (True, lambda m: ['/admin/pages?draw=1&start=0&length=25&search[value]=chapter']),
+        'admin_subscribers': (True, lambda m: ['/admin/subscribers?draw=1&start=0&length=25',
+                '/admin/subscribers?draw=1&start=5000&length=25&order[0][column]=3&order[0][dir]=desc']),
+        'admin_subscribers_search': (True, lambda m: ['/admin/subscribers?draw=1&start=0&length=25&search[value]=smith']),
+        'admin_definitions': (True, lambda m: ['/admin/definitions?draw=1&start=0&length=25']),
+        'admin_records': (True, lambda m: [f"/admin/records/{m['records_day']}"]),
+    }
+REPORTED = ['p50', 'p90', 'p99']
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    ## nearest rank
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summarize(times, queries):
+    return {
+            'count': len(times),
+            'mean': round(sum(times) / len(times), 3),
+            'p50': round(percentile(times, 50), 3),
+            'p90': round(percentile(times, 90), 3),
+            'p99': round(percentile(times, 99), 3),
+            'max': round(max(times), 3),
+            'queries': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+        }
+
+def measure(client, urls, iterations, warmup):
+    """Times in ms. Peak memory comes from one extra traced request so tracing never skews timings."""
+    for i in range(warmup):
+        client.get(urls[i % len(urls)])
+    times, queries, errors = [], [], 0
+    for i in range(iterations):
+        with QueryTracker() as tracker:
+            start = time.perf_counter()
+            response = client.get(urls[i % len(urls)])
+            response.get_data()
+            times.append((time.perf_counter() - start) * 1000)
+        queries.append(tracker.total)
+        ## a redirect to the login page or a 404 would time the wrong thing
+        errors += response.status_code != 200
+    tracemalloc.start()
+    client.get(urls[0]).get_data()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(summarize(times, queries), errors=errors, peak_kb=round(peak / 1024))
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(app, manifest, iterations=50, warmup=5, only=None, echo=print):
+    results = {}
+    client = app.test_client()
+    logged_in = False
+    for name, (admin, urls) in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        if admin and not logged_in:
+            login(client)
+            logged_in = True
+        results[name] = measure(client, urls(manifest), iterations, warmup)
+        echo(f"{name:<26} p50 {results[name]['p50']:>9.2f}ms  p99 {results[name]['p99']:>9.2f}ms  "
+                f"{results[name]['queries']:>7} queries")
+    return {
+            'meta': {
+                    'time': datetime.utcnow().isoformat(),
+                    'revision': git_revision(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'seed': manifest['seed'],
+                    'scale': manifest['scale'],
+                    'counts': manifest['counts'],
+                    'iterations': iterations,
+                    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                },
+            'scenarios': results,
+        }
+
+def change(before, after):
+    if not before:
+        return 0.0 if not after else float('inf')
+    return (after - before) / before * 100
+
+def compare(before, after, threshold=10.0, echo=print):
+    """
+    Prints the change per scenario and returns the names that regressed:
+    p90 slower by more than `threshold` percent, or more queries per request.
+    """
+    regressions = []
+    echo(f"{'scenario':<26}" + ''.join(f'{p:>18}' for p in REPORTED) + f"{'queries':>16}")
+    for name in sorted(set(before['scenarios']) | set(after['scenarios'])):
+        old, new = before['scenarios'].get(name), after['scenarios'].get(name)
+        if not old or not new:
+            echo(f"{name:<26} only in {'after' if new else 'before'}")
+            continue
+        cells = ''.join(f"{new[p]:>9.2f} {change(old[p], new[p]):>+7.1f}%" for p in REPORTED)
+        flag = ''
+        if change(old['p90'], new['p90']) > threshold or new['queries'] > old['queries']:
+            regressions.append(name)
+            flag = '  <-- regression'
+        echo(f'{name:<26}{cells}{new["queries"]:>8} ({old["queries"]}){flag}')
+    if before['meta'].get('counts') != after['meta'].get('counts'):
+        echo('Warning: the runs used different corpora.', file=sys.stderr)
+    return regressions
@@ -22,7 +22,39 @@ class Config(object):
     DATA_DIR = datadir
     TEMPLATE_DIR = templatedir
     UPLOAD_DIR = uploaddir
+    LOG_DIR = os.path.join(basedir, 'textlogs')
     BASE_URL = os.environ.get('BASE_URL') or 'https://houstonhare.com'
     ADMINS=[os.environ.get('ADMINS')]
     DEFAULT_BANNER_PATH = os.environ.get('DEFAULT_BANNER_PATH') or None
     DEFAULT_FAVICON = os.environ.get('DEFAULT_FAVICON') or None
+    VERSION_KEEP_DAYS = int(os.environ.get('VERSION_KEEP_DAYS') or 7)
+    VERSION_DAILY_DAYS = int(os.environ.get('VERSION_DAILY_DAYS') or 30)
+    PERF_ENABLED = os.environ.get('PERF_ENABLED', '1') != '0'
+    PERF_SERVER_TIMING = os.environ.get('PERF_SERVER_TIMING') == '1'
+    QUERY_TRACKING = os.environ.get('QUERY_TRACKING') == '1' or os.environ.get('FLASK_DEBUG') == '1'
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD') or 10)
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '1') != '0'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES') or 1024000)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+    METRICS_ALLOWED_IPS = (os.environ.get('METRICS_ALLOWED_IPS') or '127.0.0.1').split(',')
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES') or 200)
+    PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES') or 50 * 1024 * 1024)
+    PAGE_CHOICES_LIMIT = int(os.environ.get('PAGE_CHOICES_LIMIT') or 1000)
+    INVALIDATION_FILE = os.environ.get('INVALIDATION_FILE') or os.path.join(datadir, 'invalidation.gen')
+    PAGE_CACHE = os.environ.get('PAGE_CACHE') == '1'
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE') or 1000)
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 0)
+    PAGE_CACHE_DB = os.environ.get('PAGE_CACHE_DB') or None
+    PAGE_CACHE_SHARED_SIZE = int(os.environ.get('PAGE_CACHE_SHARED_SIZE') or 10000)
+    PUBLIC_MAX_AGE = int(os.environ.get('PUBLIC_MAX_AGE') or 60)
+    PUBLIC_S_MAXAGE = int(os.environ.get('PUBLIC_S_MAXAGE') or 86400)
+    PURGE_URL = os.environ.get('PURGE_URL') or None
+    PURGE_HEADER = os.environ.get('PURGE_HEADER') or 'xkey-purge'
+    STREAM_PAGES = os.environ.get('STREAM_PAGES', '1') != '0'
+    STREAM_MIN_CHARS = int(os.environ.get('STREAM_MIN_CHARS') or 50000)
+    MARKDOWN_BACKEND = os.environ.get('MARKDOWN_BACKEND') or 'python-markdown'
+    MARKDOWN_BLOCK_CACHE_SIZE = int(os.environ.get('MARKDOWN_BLOCK_CACHE_SIZE') or 10000)
+    STATIC_EXPORT_DIR = os.environ.get('STATIC_EXPORT_DIR') or os.path.join(datadir, 'static')
+    STATIC_EXPORT_WORKERS = int(os.environ.get('STATIC_EXPORT_WORKERS') or 4)
+    VERSION_COMPACT_BATCH = int(os.environ.get('VERSION_COMPACT_BATCH') or 200)
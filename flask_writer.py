@@ -1,7 +1,8 @@
-from app import create_app, db
+from app import create_app, db, cli
 from app.models import User, Page, Tag, Subscriber, Definition, Link, Product, Record
 
 app = create_app()
+cli.register(app)
 
 @app.shell_context_processor
 def make_shell_context():
@@ -0,0 +1,73 @@
+import os
+
+## Config reads these at import time; the tests never send real mail
+os.environ.setdefault('MAIL_USERNAME', 'test@example.com')
+os.environ.setdefault('MAIL_PASSWORD', 'test')
+
+import pytest
+from config import Config
+from app import create_app, db
+from app.models import User, Page
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    MAIL_SUPPRESS_SEND = True
+    QUERY_TRACKING = False
+    SLOW_QUERY_LOG = False
+    METRICS_ENABLED = False
+
+
+@pytest.fixture
+def config():
+    """Settings on top of TestConfig; override in a module to change them."""
+    return {}
+
+@pytest.fixture
+def app(tmp_path, config):
+    from app.admin.forms import CHOICES
+    from app.cache import page_cache
+    from app.models import NAV
+    settings = dict({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+            'DATA_DIR': str(tmp_path),
+            'LOG_DIR': str(tmp_path / 'logs'),
+            'INVALIDATION_FILE': str(tmp_path / 'invalidation.gen'),
+        }, **config)
+    ## every test starts at generation 0, so nothing cached by another may survive
+    CHOICES.clear()
+    NAV.clear()
+    page_cache.memory = page_cache.shared = None
+    app = create_app(type('RunConfig', (TestConfig,), settings))
+    with app.app_context():
+        db.create_all()
+        user = User(username='author')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_page(title, parent=None, **columns):
+    """Adds and commits a page; call inside an app context."""
+    slug = columns.pop('slug', title.lower().replace(' ', '-'))
+    dir_path = parent.path if parent else ''
+    page = Page(title=title, slug=slug, parent=parent, dir_path=dir_path,
+            path=f'{dir_path}/{slug}', user_id=User.query.first().id, **columns)
+    db.session.add(page)
+    db.session.commit()
+    return page
+
+def login(client, username='author'):
+    with client.session_transaction() as session:
+        session['user_id'] = str(User.query.filter_by(username=username).first().id)
+        session['_fresh'] = True
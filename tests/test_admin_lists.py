@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import pytest
+from app import db
+from app.models import Definition
+from conftest import add_page, login
+
+
+@pytest.fixture
+def pages(app, client):
+    with app.app_context():
+        for i in range(13):
+            ## a few share a date and a few have none, so ties and NULLs both cross page boundaries
+            pub_date = None if i % 4 == 0 else datetime(2020, 1, 1) + timedelta(days=i // 3)
+            add_page(f'Page {i:02}', template='post' if i % 2 else 'page', published=True,
+                    pub_date=pub_date)
+    login(client)
+    return client
+
+@pytest.fixture
+def definitions(app, client):
+    with app.app_context():
+        parents = [add_page('Beta'), add_page('Alpha')]
+        for i in range(12):
+            ## half have no parent, so the outer-joined title is NULL for them
+            db.session.add(Definition(name=f'Definition {i:02}', body='...',
+                    parent_id=None if i % 2 else parents[i // 2 % 2].id))
+        db.session.commit()
+    login(client)
+    return client
+
+def rows(client, url='/admin/pages', **args):
+    return client.get(url + '?' + urlencode(dict(draw=1, **args))).get_json()
+
+def walk(client, url, total, column, direction):
+    """Pages through a listing 5 rows at a time as main.js does, checking it against the full listing."""
+    order = {'order[0][column]': column, 'order[0][dir]': direction}
+    listing = rows(client, url, start=0, length=-1, **order)['data']
+    assert len(listing) == total
+    walked, cursor = [], None
+    for start in range(0, total, 5):
+        args = dict(order, start=start, length=5)
+        assert rows(client, url, **args)['data'] == listing[start:start + 5]
+        if cursor:
+            args.update(after=cursor[0], after_id=cursor[1])
+            if cursor[2]:
+                args['after_null'] = 1
+        response = rows(client, url, **args)
+        walked += response['data']
+        cursor = response['cursor']
+    assert walked == listing
+
+
+@pytest.mark.parametrize('column', [0, 1, 2, 4])
+@pytest.mark.parametrize('direction', ['asc', 'desc'])
+def test_pages_match_the_full_listing(pages, column, direction):
+    walk(pages, '/admin/pages', 13, column, direction)
+
+@pytest.mark.parametrize('column', [0, 1, 3])
+@pytest.mark.parametrize('direction', ['asc', 'desc'])
+def test_definitions_keep_rows_without_a_parent(definitions, column, direction):
+    walk(definitions, '/admin/definitions', 12, column, direction)
+
+
+def test_search_escapes_like_wildcards(pages):
+    assert rows(pages, start=0, length=10, **{'search[value]': '%'})['recordsFiltered'] == 0
+    assert rows(pages, start=0, length=10, **{'search[value]': 'Page 1'})['recordsFiltered'] == 3
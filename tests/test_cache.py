@@ -0,0 +1,84 @@
+import pytest
+from app import db
+from app.models import Page, Tag, Definition, Product
+from conftest import add_page
+
+
+@pytest.fixture
+def config():
+    return {'PAGE_CACHE': True}
+
+@pytest.fixture
+def story(app):
+    with app.app_context():
+        story = add_page('Story', template='story', published=True, banner='/story.png')
+        for i in range(3):
+            add_page(f'Chapter {i}', parent=story, template='chapter', published=True, body=f'Chapter {i} text.')
+        return story.id
+
+def get(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response
+
+def edit(app, model, id, **columns):
+    with app.app_context():
+        row = model.query.get(id)
+        for column, value in columns.items():
+            setattr(row, column, value)
+        db.session.commit()
+
+
+def test_chapter_is_tagged_with_its_story(app, client, story):
+    keys = get(client, '/story/chapter-1').headers['Surrogate-Key'].split()
+    with app.app_context():
+        chapter = Page.query.filter_by(path='/story/chapter-1').first()
+        assert {f'page:{chapter.id}', f'page:{story}', 'nav'} <= set(keys)
+
+def test_sibling_change_evicts_chapter(app, client, story):
+    get(client, '/story/chapter-1')
+    assert get(client, '/story/chapter-1').headers['X-Cache'] == 'HIT'
+    with app.app_context():
+        sibling = Page.query.filter_by(path='/story/chapter-2').first().id
+    edit(app, Page, sibling, title='Renamed Chapter')
+    response = get(client, '/story/chapter-1')
+    assert response.headers['X-Cache'] == 'MISS'
+
+def test_tag_rename_evicts_tagged_page(app, client, story):
+    with app.app_context():
+        chapter = Page.query.filter_by(path='/story/chapter-1').first()
+        chapter.tags.append(Tag(name='forest'))
+        db.session.commit()
+        tag_id = chapter.tags[0].id
+    assert 'forest' in get(client, '/story/chapter-1').get_data(as_text=True)
+    edit(app, Tag, tag_id, name='meadow')
+    assert 'meadow' in get(client, '/story/chapter-1').get_data(as_text=True)
+
+def test_glossary_follows_tagged_pages(app, client, story):
+    with app.app_context():
+        tag = Tag(name='hero')
+        db.session.add(Definition(name='Hero', body='The hero.', parent_id=story, tag=tag))
+        chapter = Page.query.filter_by(path='/story/chapter-0').first()
+        chapter.tags.append(tag)
+        db.session.commit()
+        other = Page.query.filter_by(path='/story/chapter-2').first().id
+    assert 'Chapter 0' in get(client, '/story/glossary').get_data(as_text=True)
+    ## a page gaining the tag is listed under it
+    with app.app_context():
+        page = Page.query.get(other)
+        page.tags.append(Tag.query.filter_by(name='hero').first())
+        db.session.commit()
+    assert 'Chapter 2' in get(client, '/story/glossary').get_data(as_text=True)
+
+def test_product_card_change_evicts_page(app, client, story):
+    with app.app_context():
+        product = Product(name='Paperback', price='$9.99', description='The book.', active=True)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+        chapter = Page.query.filter_by(path='/story/chapter-1').first()
+        chapter.body = f'Buy it.\n\np[{product_id}|]'
+        db.session.commit()
+    assert 'Paperback' in get(client, '/story/chapter-1').get_data(as_text=True)
+    edit(app, Product, product_id, name='Hardcover')
+    assert 'Hardcover' in get(client, '/story/chapter-1').get_data(as_text=True)
@@ -0,0 +1,96 @@
+import re
+import threading
+import pytest
+from app import db
+from app.admin.forms import page_choices
+from app.models import Definition
+from conftest import add_page, login
+
+
+@pytest.fixture
+def config():
+    return {'PAGE_CHOICES_LIMIT': 5}
+
+@pytest.fixture
+def pages(app, client):
+    with app.app_context():
+        for i in range(35):
+            add_page(f'Page {i:02}')
+        add_page('100% Done')
+    login(client)
+    return client
+
+def choices(client, **args):
+    return client.get('/admin/page/choices', query_string=args).get_json()
+
+def options(html, name):
+    select = re.search(rf'<select[^>]*name="{name}".*?</select>', html, re.DOTALL).group(0)
+    return select, re.findall(r'<option[^>]*value="([^"]*)"', select)
+
+
+def test_choices_follow_commits_across_threads(app):
+    """Readers never see a list older than the last commit before their call."""
+    with app.app_context():
+        add_page('Home')
+    committed = []
+    failures = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            with app.app_context():
+                expected = set(committed)
+                titles = {label.split(' (')[0] for pid, label in page_choices()}
+                if not expected <= titles:
+                    failures.append(expected - titles)
+                db.session.remove()
+
+    readers = [threading.Thread(target=read) for i in range(8)]
+    for reader in readers:
+        reader.start()
+    try:
+        with app.app_context():
+            for i in range(40):
+                title = f'Page {i}'
+                add_page(title)
+                committed.append(title)
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+    assert not failures
+    with app.app_context():
+        titles = [label for pid, label in page_choices()]
+    assert len(titles) == 41
+    assert 'Page 39 (/page-39)' in titles
+
+
+def test_choices_page_with_a_blank_first(pages):
+    first = choices(pages, blank='')
+    assert first['results'][0] == {'id': 0, 'text': ''}
+    assert len(first['results']) == 31
+    assert first['pagination']['more']
+    second = choices(pages, page=2)
+    assert 0 not in [r['id'] for r in second['results']]
+    assert len(second['results']) == 6
+    assert not second['pagination']['more']
+    assert choices(pages)['results'][0] == {'id': 0, 'text': '---'}
+
+def test_choices_search_escapes_like_wildcards(pages):
+    assert [r['text'] for r in choices(pages, q='%')['results']] == ['100% Done (/100%-done)']
+    assert choices(pages, q='_')['results'] == []
+    assert len(choices(pages, q='Page 1')['results']) == 10
+
+def test_choices_over_the_limit_come_from_the_endpoint(app, pages):
+    with app.app_context():
+        parent = add_page('Parent')
+        definition = Definition(name='Word', body='...', parent_id=parent.id)
+        db.session.add(definition)
+        db.session.commit()
+        ids = (parent.id, definition.id)
+    html = pages.get(f'/admin/definition/edit/{ids[1]}').get_data(as_text=True)
+    select, values = options(html, 'parent_id')
+    assert values == ['0', str(ids[0])]
+    assert 'data-ajax--url="/admin/page/choices?blank="' in select
+    select, values = options(pages.get('/admin/definition/add').get_data(as_text=True), 'parent_id')
+    assert values == ['0']
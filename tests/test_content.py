@@ -0,0 +1,42 @@
+import pytest
+from app.content import Content
+from app.render import renderer, block_cache
+
+BODY = '\n\n'.join(f'Paragraph {i} of a long chapter, -- with a dash.' * 5 for i in range(40))
+
+
+@pytest.fixture
+def renders(app, monkeypatch):
+    """Counts the blocks actually rendered."""
+    block_cache.clear()
+    calls = []
+    convert = renderer.convert
+    monkeypatch.setattr(renderer, 'convert', lambda text: calls.append(text) or convert(text))
+    return calls
+
+
+def test_excerpt_renders_only_the_first_blocks(renders):
+    excerpt = Content(BODY).excerpt()
+    assert len(renders) < 5
+    assert excerpt == Content(BODY).text[:247] + '...'
+
+def test_chunks_after_html_reuse_the_blocks(renders):
+    content = Content(BODY)
+    html = content.html
+    rendered = len(renders)
+    chunks = list(content.chunks())
+    assert len(chunks) == 40
+    assert ''.join(chunks) == html
+    assert len(renders) == rendered
+
+def test_excerpt_chunks_and_html_render_each_block_once(renders):
+    content = Content(BODY)
+    content.excerpt()
+    assert ''.join(content.chunks()) == content.html
+    assert content.text.startswith(content.excerpt()[:-3])
+    assert len(renders) == 40
+
+def test_repeated_shortcode_renders_whole(app):
+    source = 'p[1|]\n\nBetween the cards.\n\np[2|]'
+    with app.test_request_context():
+        assert len(list(Content(source).chunks())) == 1
@@ -0,0 +1,58 @@
+"""The listings and lookups the listing_indexes migration was written for use its indexes."""
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import desc, or_
+from app import db
+from app.models import Page, Subscriber, Record, LISTING
+
+
+def plan(query):
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return ' / '.join(row[-1] for row in db.session.execute(f'EXPLAIN QUERY PLAN {sql}'))
+
+def uses(query, index, sorted_by_index=True):
+    detail = plan(query)
+    assert f'INDEX {index}' in detail, detail
+    if sorted_by_index:
+        assert 'TEMP B-TREE' not in detail, detail
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+
+def test_children(ctx):
+    uses(Page.query.filter_by(parent_id=1, published=True).order_by('sort', 'pub_date', 'title'),
+            'ix_page_parent_published_sort')
+
+def test_chapter_children(ctx):
+    uses(Page.query.filter(Page.template.in_(['chapter', 'post'])).filter_by(parent_id=1, published=True)
+            .order_by('sort', 'pub_date', 'title'), 'ix_page_parent_published_sort')
+
+def test_nav(ctx):
+    uses(Page.query.filter_by(parent_id=None, published=True).order_by('sort', 'pub_date', 'title'),
+            'ix_page_parent_published_sort')
+
+def test_rss(ctx):
+    uses(Page.query.filter(or_(Page.template == 'post', Page.template == 'chapter'), Page.published == True)
+            .options(*LISTING).order_by(desc('pub_date')), 'ix_page_template_published_pub_date',
+            sorted_by_index=False)
+
+def test_path_lookup(ctx):
+    uses(Page.query.filter_by(path='/stories/sprig'), 'ix_page_path')
+
+def test_slug_lookup(ctx):
+    uses(Page.query.filter_by(slug='admin'), 'ix_page_slug')
+
+def test_subscribers_by_date(ctx):
+    uses(Subscriber.query.order_by(Subscriber.sub_date.desc()), 'ix_subscriber_sub_date')
+
+def test_records_by_date(ctx):
+    today = date.today()
+    uses(Record.query.filter(Record.date >= today - timedelta(days=30), Record.date <= today),
+            'ix_record_date')
+
+def test_records_by_created(ctx):
+    uses(Record.query.order_by(desc('created')), 'ix_record_created')
@@ -0,0 +1,37 @@
+import os
+import threading
+from app.invalidation import GenerationStore
+
+BUMPS = 10000
+
+
+def bump(store, times=BUMPS):
+    for i in range(times):
+        store.bump({'page', 'page:1'})
+
+
+def test_threads_never_lose_a_bump(tmp_path):
+    store = GenerationStore(str(tmp_path / 'invalidation.gen'))
+    threads = [threading.Thread(target=bump, args=(store,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.current() == store.get('page:1') == 4 * BUMPS
+
+
+def test_forked_workers_never_lose_a_bump(tmp_path):
+    ## as with gunicorn --preload, the store is opened before the workers fork
+    store = GenerationStore(str(tmp_path / 'invalidation.gen'))
+    children = []
+    for i in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                bump(store)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+    assert store.current() == store.get('page:1') == 4 * BUMPS
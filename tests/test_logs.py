@@ -0,0 +1,28 @@
+import os
+from sqlalchemy import event
+from app import db
+from app.admin.logs import log_path
+from conftest import login
+
+
+def test_log_stream_holds_no_connection(app, client):
+    with app.app_context():
+        path = log_path('info')
+        engine = db.engine
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'a').close()
+    held = []
+    event.listen(engine.pool, 'checkout', lambda *args: held.append(1))
+    event.listen(engine.pool, 'checkin', lambda *args: held.pop())
+    login(client)
+    response = client.get('/admin/logs/info/stream', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert held == []
+    with open(path, 'a') as f:
+        f.write('2020-01-01 00:00:00,000|INFO|test|appended\n')
+    events = iter(response.response)
+    assert next(events) == b': open\n\n'
+    assert b'appended' in next(events)
+    assert held == []
+    response.close()
@@ -0,0 +1,50 @@
+import pytest
+from app import perf
+from app.perf import QueryTracker
+from conftest import add_page, login
+
+
+def test_streamed_page_is_recorded_when_closed(app, client):
+    with app.app_context():
+        add_page('Story', template='story', published=True, body='Once upon a time.')
+    perf.stats.reset()
+    response = client.get('/story', buffered=False)
+    assert response.is_streamed
+    assert 'page.index' not in perf.stats.summary()
+    response.get_data()
+    response.close()
+    assert perf.stats.summary()['page.index']['wall_ms']['count'] == 1
+
+
+def test_reset_needs_csrf_token(app, client):
+    app.config['WTF_CSRF_ENABLED'] = True
+    with app.app_context():
+        add_page('Admin', slug='admin')
+    login(client)
+    perf.stats.record('page.index', {'wall_ms': 1})
+    client.post('/admin/perf/reset')
+    assert 'page.index' in perf.stats.summary()
+    page = client.get('/admin/perf').get_data(as_text=True)
+    token = page.split('name="csrf_token" type="hidden" value="')[1].split('"')[0]
+    client.post('/admin/perf/reset', data={'csrf_token': token})
+    assert 'page.index' not in perf.stats.summary()
+
+
+def test_query_tracker_covers_streamed_body(app, client, caplog):
+    app.config.update(QUERY_TRACKING=True, QUERY_REPEAT_THRESHOLD=0)
+    with app.app_context():
+        story = add_page('Story', template='story', published=True)
+        for i in range(3):
+            add_page(f'Chapter {i}', parent=story, template='chapter', published=True)
+    client.get('/story').get_data()
+    assert not QueryTracker.active.trackers
+    sites = [record.getMessage() for record in caplog.records if 'Possible N+1' in record.getMessage()]
+    assert any('templates/page/' in site for site in sites)
+
+
+def test_query_tracker_is_popped_when_the_view_raises(app, client):
+    app.config['QUERY_TRACKING'] = True
+    app.add_url_rule('/boom', 'boom', lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        client.get('/boom')
+    assert not QueryTracker.active.trackers
@@ -0,0 +1,34 @@
+import os
+import pstats
+import pytest
+from app import profiling
+from conftest import add_page
+
+
+@pytest.fixture
+def profiled(app, monkeypatch):
+    monkeypatch.setattr(profiling, '_settings', dict(profiling._settings, mtime=None))
+    with app.test_request_context():
+        profiling.save_settings(True, 0, '^/(story|boom)$')
+    return app
+
+
+def profile_stats(app):
+    with app.test_request_context():
+        return [pstats.Stats(os.path.join(profiling.profile_dir(), entry['name']))
+                for entry in profiling.profiles()]
+
+
+def test_streamed_body_is_profiled(profiled, client):
+    with profiled.app_context():
+        add_page('Story', template='story', published=True)
+    client.get('/story').get_data()
+    stats, = profile_stats(profiled)
+    assert any(name == 'html_body_chunks' for filename, line, name in stats.stats)
+
+
+def test_profiler_stops_when_the_view_raises(profiled, client):
+    profiled.add_url_rule('/boom', 'boom', lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        client.get('/boom')
+    assert len(profile_stats(profiled)) == 1
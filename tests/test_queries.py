@@ -0,0 +1,43 @@
+"""Listings run the same number of queries however many children they list."""
+import pytest
+from app import db
+from app.models import Page, Tag, Product
+from app.perf import QueryTracker
+from conftest import add_page
+
+N = 4
+
+
+def build(name, template, children, child_template):
+    parent = add_page(name.title(), slug=name, template=template, published=True, banner='/banner.png')
+    tag = Tag(name=f'{name}-tag')
+    for i in range(children):
+        child = add_page(f'{name} {child_template} {i}', slug=f'{child_template}-{i}', parent=parent,
+                template=child_template, published=True, body=f'Part {i}.\n\np[1|]')
+        child.tags.append(tag)
+    db.session.commit()
+    return parent.path
+
+def queries(client, url):
+    with QueryTracker() as tracker:
+        response = client.get(url)
+        assert response.status_code == 200, url
+    return tracker.total
+
+def totals(client, paths):
+    ## the first request after a change rebuilds the nav
+    client.get(paths[0])
+    return [queries(client, url) for path in paths for url in [path, f'/rss{path}']] + [queries(client, '/rss/all')]
+
+
+@pytest.mark.parametrize('template, child_template', [('story', 'chapter'), ('blog', 'post')])
+def test_listings_are_flat(app, client, template, child_template):
+    with app.app_context():
+        add_page('Home', template='page', published=True)
+        db.session.add(Product(name='Paperback', price='$9.99', active=True))
+        small = build('small', template, N, child_template)
+    before = totals(client, [small])
+    with app.app_context():
+        large = build('large', template, 2 * N, child_template)
+    after = totals(client, [large])
+    assert before == after
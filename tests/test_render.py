@@ -0,0 +1,71 @@
+"""Block-rendered markdown is byte for byte what python-markdown renders whole."""
+import random
+import pytest
+from markdown import markdown
+from app import db
+from app.content import Content
+from app.models import Product
+from app.render import render_markdown, split_blocks, block_cache
+from benchmarks.corpus import Writer
+
+CORPUS = {
+    'paragraphs': 'One paragraph.\n\nAnother, with *emphasis*.\n\n\n\nAfter extra blank lines.',
+    'headings': '# Title\n\nText.\n\nSetext\n======\n\n## Section ##\n\nMore text.',
+    'tight list': '* one\n* two\n* three\n\nAfter.',
+    'loose list': '* one\n\n* two\n\n    continued in the item\n\n* three\n\nAfter.',
+    'ordered list': '1. first\n2. second\n\n3. third, loose\n\nAfter.',
+    'nested list': '* outer\n\n    * inner\n    * inner\n\n* outer again',
+    'list then code': '* item\n\n\n    indented after a list',
+    'quotes': '> quoted\n> still quoted\n\n> a second quote\n\nAfter.',
+    'nested quote': '> outer\n>\n> > inner\n\nAfter.',
+    'lazy quote': '> starts quoted\ncontinues lazily\n\nAfter.',
+    'indented code': 'Text.\n\n    code line\n    more code\n\n    after a blank line in the code\n\nAfter.',
+    'code with blank lines': '    first\n\n\n\n    second',
+    'reference links': 'See [the site][site] and [this][].\n\n[site]: http://example.com\n[this]: /this "Title"',
+    'reference before use': '[site]: http://example.com\n\nLater, [a link][site].',
+    'raw html': '<div class="box">\n\nMarkdown *inside* stays raw.\n\n</div>\n\nAfter.',
+    'raw html comment': '<!-- a comment\n\nacross blank lines -->\n\nAfter.',
+    'inline html': 'Text with <span class="x">inline</span> html.\n\nAnother.',
+    'horizontal rules': 'Above.\n\n---\n\nBelow.\n\n* * *\n\nEnd.',
+    'hard breaks': 'Line one  \nline two\n\nNext.',
+    'whitespace lines': 'One.\n   \nTwo.\n\t\nThree.',
+    'crlf': 'One.\r\n\r\nTwo.\r\n\r\n* a\r\n* b',
+    'tabs': '*\titem\n\n\tcode with a tab',
+    'product cards': 'Buy it:\n\np[1|]\n\nOr the other.\n\np[2|price]',
+    'typography': 'A pause -- then more.\n\n---\n\nA new scene.',
+    'empty': '',
+}
+
+
+@pytest.mark.parametrize('name', sorted(CORPUS))
+def test_blocks_match_markdown(name):
+    block_cache.clear()
+    text = Content(CORPUS[name]).get('markdown')
+    assert render_markdown(text) == markdown(text)
+    ## and again from the cache
+    assert render_markdown(text) == markdown(text)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_generated_bodies_match_markdown(seed):
+    text = Content(Writer(random.Random(seed)).body(600, products=2)).get('markdown')
+    assert len(split_blocks(text)) > 1
+    assert render_markdown(text) == markdown(text)
+
+def test_edited_block_matches_markdown():
+    text = Content(Writer(random.Random(1)).body(600)).get('markdown')
+    render_markdown(text)
+    blocks = split_blocks(text)
+    blocks[3] += ' Edited.'
+    edited = '\n\n'.join(blocks)
+    assert render_markdown(edited) == markdown(edited)
+
+def test_product_cards_in_chunks(app):
+    with app.test_request_context():
+        db.session.add_all([Product(name='Paperback', price='$9.99', active=True),
+                Product(name='Hardcover', price='$19.99', active=True)])
+        db.session.commit()
+        for source in [CORPUS['product cards'], 'Just one card:\n\np[1|]\n\nAfter.']:
+            content = Content(source)
+            chunks = ''.join(content.chunks())
+            assert chunks == Content(source).html
+            assert 'Paperback' in chunks
@@ -0,0 +1,15 @@
+from benchmarks.replay import Target, replay
+from conftest import add_page
+
+
+def test_view_exceptions_count_as_errors(app):
+    def broken():
+        raise RuntimeError('replayed')
+    app.add_url_rule('/broken', 'broken', broken)
+    with app.app_context():
+        add_page('Home', template='page', published=True)
+    result = replay(Target(app), [(0, '/broken'), (0, '/')] * 5, concurrency=4)
+    assert result['total']['count'] == 10
+    assert result['routes']['broken']['count'] == 5
+    assert result['routes']['broken']['error_rate'] == 1.0
+    assert result['total']['errors'] == 5
@@ -0,0 +1,37 @@
+import pytest
+from conftest import add_page
+
+BODY = '\n\n'.join(f'Paragraph {i} of a long chapter.' * 20 for i in range(50))
+
+
+def streamed(response):
+    ## the test client wraps every body in an iterator; only a whole one knows its length
+    return 'Content-Length' not in response.headers
+
+
+@pytest.fixture
+def config():
+    return {'STREAM_MIN_CHARS': 1000}
+
+@pytest.fixture
+def chapter(app):
+    with app.app_context():
+        story = add_page('Story', template='story', published=True)
+        add_page('Chapter', parent=story, template='chapter', published=True, body=BODY)
+    return '/story/chapter'
+
+
+def test_long_chapter_streams(client, chapter):
+    response = client.get(chapter, buffered=False)
+    assert streamed(response)
+    html = response.get_data(as_text=True)
+    assert 'content="Paragraph 0 of a long chapter.' in html
+    assert 'Paragraph 49 of a long chapter.' in html
+
+def test_flashed_message_renders_whole(client, chapter):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'You are subscribed.')]
+    response = client.get(chapter, buffered=False)
+    assert not streamed(response)
+    assert 'You are subscribed.' in response.get_data(as_text=True)
+    assert 'You are subscribed.' not in client.get(chapter).get_data(as_text=True)
@@ -0,0 +1,81 @@
+import re
+import threading
+from app import db
+from app.models import Definition, Link, Product
+from conftest import login
+
+THREADS = 8
+ROUNDS = 10
+
+
+def run_threads(app, work):
+    """Runs work(client, i) on THREADS clients at once and returns whatever they fail."""
+    failures = []
+    barrier = threading.Barrier(THREADS)
+
+    def worker(i):
+        client = app.test_client()
+        with app.app_context():
+            login(client)
+        barrier.wait()
+        try:
+            for round in range(ROUNDS):
+                work(client, i)
+        except Exception as e:
+            failures.append((i, repr(e)))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failures
+
+def value(html, name):
+    return re.search(rf'id="{name}" name="{name}"[^>]*value="([^"]*)"', html).group(1)
+
+def selected(html, name):
+    select = re.search(rf'<select[^>]*name="{name}".*?</select>', html, re.DOTALL).group(0)
+    return re.findall(r'<option selected value="([^"]*)"', select)
+
+
+def test_edit_views_render_their_own_object(app):
+    with app.app_context():
+        definitions = [Definition(name=f'Definition {i}', body=f'Body {i}') for i in range(THREADS)]
+        db.session.add_all(definitions)
+        db.session.commit()
+        ids = [d.id for d in definitions]
+
+    def work(client, i):
+        html = client.get(f'/admin/definition/edit/{ids[i]}').get_data(as_text=True)
+        assert value(html, 'name') == f'Definition {i}'
+        assert f'data-id="{ids[i]}"' in html
+        ## an invalid post re-renders the posted data, not another thread's
+        html = client.post(f'/admin/definition/edit/{ids[i]}', data={'name': f'Renamed {i}',
+                'type': 'other', 'body': '', 'parent_id': 0, 'tag_id': 0}).get_data(as_text=True)
+        assert value(html, 'name') == f'Renamed {i}'
+        assert f'data-id="{ids[i]}"' in html
+
+    assert not run_threads(app, work)
+
+def test_add_views_start_from_their_own_form(app):
+    with app.app_context():
+        products = [Product(name=f'Product {i}') for i in range(THREADS)]
+        db.session.add_all(products)
+        db.session.commit()
+        ids = [p.id for p in products]
+
+    def work(client, i):
+        html = client.get(f'/admin/link/add?product_id={ids[i]}').get_data(as_text=True)
+        assert selected(html, 'product_id') == [str(ids[i])]
+        assert value(html, 'text') == ''
+        response = client.post('/admin/link/add', data={'text': f'Link {i}',
+                'product_id': ids[i], 'url': f'/link-{i}', 'sort': i})
+        assert response.status_code == 302
+
+    assert not run_threads(app, work)
+    with app.app_context():
+        for i, product_id in enumerate(ids):
+            links = Link.query.filter_by(product_id=product_id).all()
+            assert {(link.text, link.url) for link in links} == {(f'Link {i}', f'/link-{i}')}
+            assert len(links) == ROUNDS